@@ -1,10 +1,22 @@
-import os
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk, filedialog, simpledialog, messagebox
-from openpyxl import load_workbook, Workbook
+from openpyxl import load_workbook
 from openpyxl.utils import column_index_from_string, get_column_letter
-from openpyxl.styles import PatternFill
-import pandas as pd
+from olemerge import make_task, merge_folder
+from olecombine import make_combine_spec, combine_spec_from_letters, CombineJob
+from olemetrics import RunMetrics
+
+# How blanked zeros in the merges and combined groups in the GUI are highlighted: "fill" styles
+# every cell, "conditional" adds one conditional formatting rule per sheet instead
+HIGHLIGHT_MARKING = "fill"
+
+# How often the combine window checks on its worker, in milliseconds
+POLL_MS = 100
+
+# Combine columns offered at startup (class name, class number, grouping criteria, values), e.g. "A,B,C,D"
+DEFAULT_COMBINE_COLUMNS = ""
 
 # Function to get user input for process and criteria ranges, with defaults
 def get_user_input(task_name, default_process_range, default_criteria_range):
@@ -31,117 +43,35 @@ def get_user_input(task_name, default_process_range, default_criteria_range):
 
     return process_range, criteria_range
 
-# Function to parse range strings
-def parse_range(range_str):
-    start, end = range_str.split(':')
-    def split_col_row(cell):
-        col = ''.join(filter(str.isalpha, cell))
-        row = ''.join(filter(str.isdigit, cell))
-        return col, int(row)
-    start_col, start_row = split_col_row(start)
-    end_col, end_row = split_col_row(end)
-    return start_col, start_row, end_col, end_row
+# Function to ask up front for the OLE combine columns; returns their letters, or None to pick them
+# in the combine window after the merge
+def get_combine_columns():
+    root = tk.Tk()
+    root.withdraw()
+
+    columns = simpledialog.askstring(
+        "Input",
+        "Combine OLE rows while merging? Enter the class name, class number, grouping criteria and "
+        "values columns (e.g., A,B,C,D), or leave empty to choose them after the merge:",
+        initialvalue=DEFAULT_COMBINE_COLUMNS
+    )
+    if not columns or not columns.strip():
+        return None
+    letters = [letter.strip() for letter in columns.split(',')]
+    if len(letters) != 4 or not all(letter.isalpha() for letter in letters):
+        print("Invalid combine columns. Combining after the merge instead.")
+        return None
+    return letters
 
 # Function to process Excel files and generate merged files
-def process_excel_files(target_folder, task_name, process_range, criteria_range):
+def process_excel_files(target_folder, task_name, process_range, criteria_range, workers=1):
     print(f"Starting the process for {task_name}...")
     print(f"Process range: {process_range}")
     print(f"Criteria range: {criteria_range}")
 
-    proc_start_col, proc_start_row, proc_end_col, proc_end_row = parse_range(process_range)
-    crit_start_col, crit_start_row, crit_end_col, crit_end_row = parse_range(criteria_range)
-
-    merge_wb = Workbook()
-    merge_ws = merge_wb.active
-    merge_ws.title = f"Merged Data {task_name}"
-
-    files_processed = 0
-    sheets_processed = 0
-    rows_merged = 0
-
-    for filename in os.listdir(target_folder):
-        if filename.endswith('.xlsx') and not filename.startswith('~$'):
-            file_path = os.path.join(target_folder, filename)
-            print(f"Processing file: {filename}")
-
-            try:
-                wb = load_workbook(file_path, data_only=True)
-
-                for sheet_name in wb.sheetnames:
-                    if sheet_name not in ["index", "list", "setting", "TEMPLATE", "STUDENTINFO"]:
-                        print(f"  Processing sheet: {sheet_name}")
-                        ws = wb[sheet_name]
-
-                        last_row = crit_start_row - 1
-                        for row in range(crit_start_row, crit_end_row + 1):
-                            if ws[f'{crit_start_col}{row}'].value is not None and ws[f'{crit_start_col}{row}'].value != "":
-                                last_row = row
-
-                        if last_row >= crit_start_row:
-                            print(f"    Copying range {proc_start_col}{proc_start_row}:{proc_end_col}{last_row}")
-
-                            # Copy non-blank rows to merge sheet
-                            for row in range(proc_start_row, last_row + 1):
-                                if any(ws.cell(row=row, column=col).value not in (None, "")
-                                       for col in range(column_index_from_string(proc_start_col), column_index_from_string(proc_end_col) + 1)):
-                                    rows_merged += 1
-                                    for col in range(column_index_from_string(proc_start_col), column_index_from_string(proc_end_col) + 1):
-                                        source_value = ws.cell(row=row, column=col).value
-                                        merge_ws.cell(row=rows_merged, column=col - column_index_from_string(proc_start_col) + 1, value=source_value)
-
-                                    # Add sheet name in column S (19th column, index 19)
-                                    merge_ws.cell(row=rows_merged, column=19, value=sheet_name)
-
-                            sheets_processed += 1
-
-                wb.close()
-                files_processed += 1
-
-            except Exception as e:
-                print(f"Error processing file {filename}: {str(e)}")
-
-    # Concatenate values from columns P and S and replace values in column P
-    for row in range(1, merge_ws.max_row + 1):
-        p_value = merge_ws.cell(row=row, column=16).value
-        s_value = merge_ws.cell(row=row, column=19).value
-        if p_value and s_value:
-            concat_value = f"{p_value}-{s_value}"
-            merge_ws.cell(row=row, column=16, value=concat_value)
-
-    # Additional concatenation for "Displine" task: concatenate I and S into I
-    if task_name == "Displine":
-        for row in range(1, merge_ws.max_row + 1):
-            i_value = merge_ws.cell(row=row, column=9).value  # Column I
-            s_value = merge_ws.cell(row=row, column=19).value  # Column S
-            if i_value and s_value:
-                concat_value = f"{i_value}-{s_value}"
-                merge_ws.cell(row=row, column=9, value=concat_value)
-
-    # Insert header row at the top with t1, t2, t3, ..., tn
-    merge_ws.insert_rows(1)
-    max_col = merge_ws.max_column
-    for col in range(1, max_col + 1):
-        cell = merge_ws.cell(row=1, column=col)
-        cell.value = f"t{col}"
-
-    # Detect and mark zero values
-    pink_fill = PatternFill(start_color='FFC0CB', end_color='FFC0CB', fill_type='solid')
-    for row in merge_ws.iter_rows(min_row=2, max_row=merge_ws.max_row, max_col=max_col):
-        for cell in row:
-            if cell.value == 0 or cell.value == 0.0:
-                cell.value = ""
-                cell.fill = pink_fill
-
-    merge_path = os.path.join(target_folder, f"merge_{task_name}.xlsx")
-    try:
-        merge_wb.save(merge_path)
-        print(f"Merged data saved to {merge_path}")
-    except Exception as e:
-        print(f"Error saving merged file: {str(e)}")
-
-    print(f"Process completed for {task_name}. Files processed: {files_processed}, Sheets processed: {sheets_processed}")
-    print(f"Total non-blank rows merged: {rows_merged}")
-    return merge_path
+    concat_columns = ["P", "I"] if task_name == "Displine" else ["P"]
+    task = make_task(task_name, process_range, criteria_range, concat_columns, zero_marking=HIGHLIGHT_MARKING)
+    return merge_folder(target_folder, [task], workers)[task_name]
 
 # GUI Class for Combine Awards
 class ExcelProcessorGUI:
@@ -160,13 +90,11 @@ class ExcelProcessorGUI:
         ttk.Label(self.main_frame, text="Preview of File:").grid(row=0, column=0, sticky=tk.W)
         self.preview_table = ttk.Treeview(self.main_frame, height=10)
         self.preview_table.grid(row=1, column=0, columnspan=3, pady=10)
-        self.load_preview()
 
         # Sheet selection dropdown
         ttk.Label(self.main_frame, text="Sheet Name:").grid(row=2, column=0, sticky=tk.W, pady=5)
         self.sheet_combobox = ttk.Combobox(self.main_frame, width=47, state="readonly")
         self.sheet_combobox.grid(row=2, column=1, padx=5, pady=5)
-        self.update_sheet_list()
 
         # Column indices
         ttk.Label(self.main_frame, text="Column Indices (specify by letter)").grid(row=3, column=0, columnspan=3, pady=10)
@@ -181,37 +109,79 @@ class ExcelProcessorGUI:
             self.entries.append(entry)
 
         # Process button
-        ttk.Button(self.main_frame, text="Process Excel", command=self.process_excel).grid(row=8, column=0, columnspan=1, pady=20)
+        self.process_button = ttk.Button(self.main_frame, text="Process Excel", command=self.process_excel)
+        self.process_button.grid(row=8, column=0, columnspan=1, pady=20)
 
         # Restart Task button
         ttk.Button(self.main_frame, text="Restart Task", command=self.restart_task).grid(row=8, column=1, columnspan=1, pady=20)
 
-    def load_preview(self):
-        # Load preview of the file
+        # Progress of the combine, which runs in a worker process, and its Cancel button
+        self.status = tk.StringVar(value="Loading preview...")
+        ttk.Label(self.main_frame, textvariable=self.status).grid(row=9, column=0, columnspan=2, sticky=tk.W)
+        self.progress_bar = ttk.Progressbar(self.main_frame, mode="indeterminate", length=200)
+        self.progress_bar.grid(row=10, column=0, columnspan=2, sticky=tk.W, pady=5)
+        self.cancel_button = ttk.Button(self.main_frame, text="Cancel", command=self.cancel_job, state="disabled")
+        self.cancel_button.grid(row=10, column=2, pady=5)
+        self.job = None
+
+        # The preview and sheet list are read in a worker thread; the window fills them in as they arrive
+        self.file_queue = queue.Queue()
+        threading.Thread(target=self.read_file, args=(self.file_path, self.file_queue), daemon=True).start()
+        self.root.after(POLL_MS, self.check_file_loaded, self.file_queue, 2)
+
+    # Runs in the worker thread: read the preview rows and the sheet names, queueing each result
+    def read_file(self, file_path, file_queue):
         try:
-            df = pd.read_excel(self.file_path, nrows=10)  # Load first 10 rows for preview
-            self.preview_table["columns"] = list(df.columns)
-            self.preview_table["show"] = "headings"
-
-            # Add headers with Excel-like column letters (A, B, C, etc.)
-            for i, col in enumerate(df.columns):
-                col_letter = get_column_letter(i + 1)
-                self.preview_table.heading(col, text=f"{col_letter} - {col}")
-                self.preview_table.column(col, width=100)
-            for _, row in df.iterrows():
-                self.preview_table.insert("", "end", values=list(row))
+            # pandas is only needed here, so it is imported on first use
+            import pandas as pd
+            file_queue.put(("preview", pd.read_excel(file_path, nrows=10)))  # Load first 10 rows for preview
         except Exception as e:
-            messagebox.showerror("Error", f"Error loading preview: {e}")
-
-    def update_sheet_list(self):
+            file_queue.put(("preview_error", e))
         try:
-            wb = load_workbook(self.file_path)
-            sheet_names = wb.sheetnames
-            self.sheet_combobox['values'] = sheet_names
-            self.sheet_combobox.set(sheet_names[0])  # Set default value to first sheet
+            wb = load_workbook(file_path, read_only=True)
+            file_queue.put(("sheets", wb.sheetnames))
             wb.close()
         except Exception as e:
-            messagebox.showerror("Error", f"Error loading Excel file:\n{str(e)}")
+            file_queue.put(("sheets_error", e))
+
+    def check_file_loaded(self, file_queue, pending):
+        # A restarted task has its own queue; the old one is dropped
+        if file_queue is not self.file_queue:
+            return
+        while pending:
+            try:
+                kind, result = file_queue.get_nowait()
+            except queue.Empty:
+                break
+            pending -= 1
+            if kind == "preview":
+                self.load_preview(result)
+            elif kind == "sheets":
+                self.update_sheet_list(result)
+            elif kind == "preview_error":
+                messagebox.showerror("Error", f"Error loading preview: {result}")
+            else:
+                messagebox.showerror("Error", f"Error loading Excel file:\n{str(result)}")
+        if pending:
+            self.root.after(POLL_MS, self.check_file_loaded, file_queue, pending)
+        elif self.job is None:
+            self.status.set("")
+
+    def load_preview(self, df):
+        self.preview_table["columns"] = list(df.columns)
+        self.preview_table["show"] = "headings"
+
+        # Add headers with Excel-like column letters (A, B, C, etc.)
+        for i, col in enumerate(df.columns):
+            col_letter = get_column_letter(i + 1)
+            self.preview_table.heading(col, text=f"{col_letter} - {col}")
+            self.preview_table.column(col, width=100)
+        for _, row in df.iterrows():
+            self.preview_table.insert("", "end", values=list(row))
+
+    def update_sheet_list(self, sheet_names):
+        self.sheet_combobox['values'] = sheet_names
+        self.sheet_combobox.set(sheet_names[0])  # Set default value to first sheet
 
     def process_excel(self):
         try:
@@ -220,64 +190,57 @@ class ExcelProcessorGUI:
             col_letters = [entry.get().strip().upper() for entry in self.entries]  # Convert input to uppercase letters
             col_indices = [column_index_from_string(letter) - 1 for letter in col_letters]  # Convert to 0-based indices
 
-            # Load workbook
-            wb = load_workbook(self.file_path)
-            ws = wb[sheet_name]
-
-            # Create dictionary to store groups
-            groups = {}
-            yellow_fill = PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid')
-
-            # First pass: identify groups and collect data
-            rows_to_delete = set()
-            for row_idx, row in enumerate(ws.iter_rows(min_row=2), start=2):  # Skip header row
-                try:
-                    class_name = row[col_indices[0]].value.lower() if row[col_indices[0]].value else ""
-                    class_num = row[col_indices[1]].value
-                    group_criteria = row[col_indices[2]].value
-
-                    if not any([class_name, class_num, group_criteria]):
-                        continue
-
-                    key = (class_name, class_num, group_criteria)
-
-                    if key not in groups:
-                        groups[key] = {
-                            'values': [row[col_indices[3]].value],
-                            'first_row': row_idx,
-                            'rows_to_combine': [row_idx]
-                        }
-                    else:
-                        groups[key]['values'].append(row[col_indices[3]].value)
-                        groups[key]['rows_to_combine'].append(row_idx)
-                        rows_to_delete.add(row_idx)
-                except IndexError:
-                    messagebox.showerror("Error", f"Row {row_idx} has fewer columns than specified. Please check your column indices.")
-                    return
-                except Exception as e:
-                    messagebox.showerror("Error", f"Error processing row {row_idx}: {str(e)}")
-                    return
-
-            # Second pass: combine values and delete rows
-            for key, group_data in groups.items():
-                if len(group_data['values']) > 1:
-                    combined_value = ', '.join(v for v in group_data['values'] if v)
-                    first_row = group_data['first_row']
-
-                    ws.cell(row=first_row, column=col_indices[3] + 1).value = combined_value
-
-                    for cell in ws[first_row]:
-                        cell.fill = yellow_fill
-
-            for row_idx in sorted(rows_to_delete, reverse=True):
-                ws.delete_rows(row_idx)
-
-            output_path = self.file_path.rsplit('.', 1)[0] + '_processed.xlsx'
-            wb.save(output_path)
-
-            messagebox.showinfo("Success", f"Processing complete!\nSaved as: {output_path}")
+            # Group the rows and write the combined sheet in a worker process, polled from here
+            spec = make_combine_spec(col_indices)
+            self.job = CombineJob(self.file_path, sheet_name, spec, marking=HIGHLIGHT_MARKING)
         except Exception as e:
             messagebox.showerror("Error", f"An error occurred:\n{str(e)}")
+            return
+
+        self.process_button.configure(state="disabled")
+        self.cancel_button.configure(state="normal")
+        self.status.set("Loading workbook...")
+        self.progress_bar.start()
+        self.root.after(POLL_MS, self.check_job, self.job)
+
+    def check_job(self, job):
+        if job is not self.job:
+            return
+        for message in job.poll():
+            kind = message[0]
+            if kind == "scanned":
+                self.status.set(f"Scanned {message[1]} rows...")
+            elif kind == "groups":
+                self.status.set(f"Found {message[1]} groups, writing...")
+            elif kind == "written":
+                self.status.set(f"Wrote {message[1]} rows")
+            elif kind == "done":
+                self.finish_job()
+                messagebox.showinfo("Success", f"Processing complete!\nSaved as: {message[1]}")
+            elif kind == "row_error":
+                _, row_idx, index_error, error = message
+                self.finish_job()
+                if index_error:
+                    messagebox.showerror("Error", f"Row {row_idx} has fewer columns than specified. Please check your column indices.")
+                else:
+                    messagebox.showerror("Error", error)
+            else:
+                self.finish_job()
+                messagebox.showerror("Error", f"An error occurred:\n{message[1]}")
+        if not job.finished:
+            self.root.after(POLL_MS, self.check_job, job)
+
+    def cancel_job(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.finish_job()
+            self.status.set("Cancelled")
+
+    def finish_job(self):
+        self.job = None
+        self.progress_bar.stop()
+        self.process_button.configure(state="normal")
+        self.cancel_button.configure(state="disabled")
 
     def restart_task(self):
         # Prompt for a new file and reinitialize the GUI
@@ -286,6 +249,7 @@ class ExcelProcessorGUI:
             filetypes=[("Excel files", "*.xlsx *.xls")]
         )
         if new_file_path:
+            self.cancel_job()
             # Destroy old widgets
             self.main_frame.destroy()
             # Reinitialize with new file
@@ -313,14 +277,34 @@ if __name__ == "__main__":
         "Displine", default_displine_process_range, default_displine_criteria_range
     )
 
-    merge_ole_path = None
-    if ole_process_range and ole_criteria_range:
-        merge_ole_path = process_excel_files(target_folder, "OLE", ole_process_range, ole_criteria_range)
+    # With the combine columns given up front, OLE rows are combined as they are merged and
+    # merge_OLE_processed.xlsx is written directly, without the combine window
+    combine_columns = get_combine_columns()
+    combine = combine_spec_from_letters(combine_columns) if combine_columns else None
 
+    # Both tasks are extracted in one pass, so every workbook is opened only once
+    tasks = []
+    if ole_process_range and ole_criteria_range:
+        tasks.append(make_task("OLE", ole_process_range, ole_criteria_range, zero_marking=HIGHLIGHT_MARKING,
+                               combine=combine))
     if displine_process_range and displine_criteria_range:
-        process_excel_files(target_folder, "Displine", displine_process_range, displine_criteria_range)
-
-    if merge_ole_path:
+        tasks.append(make_task("Displine", displine_process_range, displine_criteria_range, concat_columns=["P", "I"],
+                               zero_marking=HIGHLIGHT_MARKING))
+
+    # Unchanged workbooks are served from the extraction cache kept in the target folder
+    metrics = RunMetrics()
+    merge_paths = merge_folder(target_folder, tasks, workers=None, use_cache=True, metrics=metrics) if tasks else {}
+    merge_ole_path = merge_paths.get("OLE")
+
+    # OLE rows that could not be combined were saved as merge_OLE.xlsx; the combine window opens on it
+    combine_failures = [record for record in metrics.combine_failures if record['task'] == "OLE"]
+    if combine_failures:
+        messagebox.showerror("Error", f"Could not combine the OLE rows: {combine_failures[0]['error']}\n"
+                                      f"The uncombined merge was saved as: {merge_ole_path}")
+
+    if merge_ole_path and combine and not combine_failures:
+        messagebox.showinfo("Success", f"Processing complete!\nSaved as: {merge_ole_path}")
+    elif merge_ole_path:
         root = tk.Tk()
         app = ExcelProcessorGUI(root, merge_ole_path)
         root.mainloop()
\ No newline at end of file
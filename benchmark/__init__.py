@@ -0,0 +1 @@
+# Benchmark suite for the OLE/Displine merge: python -m benchmark --help
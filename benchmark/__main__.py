@@ -0,0 +1,4 @@
+import sys
+from benchmark.runner import main
+
+sys.exit(main())
@@ -0,0 +1,145 @@
+import os
+import random
+import re
+import zipfile
+from openpyxl import Workbook
+from olemerge import EXCLUDED_SHEETS
+
+# Synthetic class workbooks shaped like the SharePoint exports: setup sheets, then one sheet
+# per student with the OLE block in CV26:DM205, the Displine block in BB26:BJ205 and the tick in M4.
+
+OLE_FIRST_COL = 100     # CV
+OLE_LAST_COL = 117      # DM
+DISPLINE_FIRST_COL = 54 # BB
+DISPLINE_LAST_COL = 62  # BJ
+FIRST_DATA_ROW = 26
+LAST_DATA_ROW = 205
+
+ACTIVITIES = ["Basketball", "Choir", "Community Service", "Science Fair", "Drama", "Chess Club", "Art Exhibition"]
+ROLES = ["Member", "Leader", "Participant", "Helper", "Captain"]
+OFFENCES = ["Late", "Uniform", "Homework", "Conduct", "Absent"]
+
+# Function to pick a value for one OLE column, with a share of zeros for the pink-marking pass
+def ole_value(rnd, col, zero_rate):
+    if rnd.random() < zero_rate:
+        return 0
+    offset = col - OLE_FIRST_COL
+    if offset == 0:
+        return rnd.choice(ACTIVITIES)
+    if offset in (1, 2):
+        return rnd.choice(ROLES)
+    if offset == 15:
+        return f"{rnd.randint(2019, 2025)}-{rnd.randint(1, 9)}"
+    if offset % 3 == 0:
+        return rnd.randint(1, 40)
+    if offset % 3 == 1:
+        return round(rnd.random() * 10, 1)
+    return None if rnd.random() < 0.3 else rnd.choice(ROLES)
+
+# Function to pick a value for one Displine column
+def displine_value(rnd, col, zero_rate):
+    if rnd.random() < zero_rate:
+        return 0
+    offset = col - DISPLINE_FIRST_COL
+    if offset == 0:
+        return rnd.choice(OFFENCES)
+    if offset in (1, 2):
+        return rnd.randint(1, 5)
+    return None if rnd.random() < 0.2 else f"note {rnd.randint(1, 99)}"
+
+# Function to fill one student sheet
+def fill_student_sheet(ws, rnd, ole_rows, displine_rows, ticked, zero_rate):
+    # Student details above the data blocks
+    ws["A1"] = "Student Record"
+    ws["B3"] = f"Student {rnd.randint(1, 999)}"
+    ws["M4"] = "✔" if ticked else None
+    for row in range(5, 12):
+        ws.cell(row=row, column=2, value=f"info {row}")
+
+    for row in range(FIRST_DATA_ROW, FIRST_DATA_ROW + ole_rows):
+        for col in range(OLE_FIRST_COL, OLE_LAST_COL + 1):
+            value = ole_value(rnd, col, zero_rate)
+            if value is not None:
+                ws.cell(row=row, column=col, value=value)
+    for row in range(FIRST_DATA_ROW, FIRST_DATA_ROW + displine_rows):
+        for col in range(DISPLINE_FIRST_COL, DISPLINE_LAST_COL + 1):
+            value = displine_value(rnd, col, zero_rate)
+            if value is not None:
+                ws.cell(row=row, column=col, value=value)
+
+# Function to rewrite openpyxl's inline strings as a shared string table, as Excel saves them
+def convert_to_shared_strings(path):
+    strings = []
+    index = {}
+    cell_pattern = re.compile(r'<c ([^>]*?)t="inlineStr"([^>]*)><is>(.*?)</is></c>', re.S)
+
+    def shared_cell(match):
+        before, after, body = match.groups()
+        if body not in index:
+            index[body] = len(strings)
+            strings.append(body)
+        return f'<c {before}t="s"{after}><v>{index[body]}</v></c>'
+
+    with zipfile.ZipFile(path) as source:
+        parts = [(item, source.read(item.filename)) for item in source.infolist()]
+
+    converted = []
+    for item, data in parts:
+        if item.filename.startswith("xl/worksheets/"):
+            data = cell_pattern.sub(shared_cell, data.decode("utf-8")).encode("utf-8")
+        elif item.filename == "xl/_rels/workbook.xml.rels":
+            data = data.replace(
+                b"</Relationships>",
+                b'<Relationship Id="rIdSharedStrings" Type="http://schemas.openxmlformats.org/'
+                b'officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/></Relationships>'
+            )
+        elif item.filename == "[Content_Types].xml" and b"sharedStrings" not in data:
+            data = data.replace(
+                b"</Types>",
+                b'<Override PartName="/xl/sharedStrings.xml" ContentType="application/'
+                b'vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/></Types>'
+            )
+        converted.append((item.filename, data))
+
+    table = "".join(f"<si>{body}</si>" for body in strings)
+    converted.append(("xl/sharedStrings.xml", (
+        '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        f'count="{len(strings)}" uniqueCount="{len(strings)}">{table}</sst>'
+    ).encode("utf-8")))
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as target:
+        for name, data in converted:
+            target.writestr(name, data)
+
+# Function to generate a corpus of class workbooks in a folder, returning their paths.
+# Each file gets the excluded setup sheets plus `sheets` student sheets; a share of the
+# student sheets are untouched template copies and a share are not ticked in M4.
+def generate_corpus(folder, files=10, sheets=30, max_rows=60, seed=0, tick_rate=0.7,
+                    untouched_rate=0.2, zero_rate=0.05, shared_strings=True):
+    os.makedirs(folder, exist_ok=True)
+    rnd = random.Random(seed)
+    paths = []
+    for file_idx in range(files):
+        wb = Workbook()
+        wb.active.title = EXCLUDED_SHEETS[0]
+        for name in EXCLUDED_SHEETS[1:]:
+            template = wb.create_sheet(name)
+            template["CV26"] = "template"
+
+        for sheet_idx in range(sheets):
+            ws = wb.create_sheet(f"{file_idx + 1}{chr(65 + file_idx % 5)}{sheet_idx + 1:02d}")
+            if rnd.random() < untouched_rate:
+                fill_student_sheet(ws, rnd, 0, 0, False, zero_rate)
+                continue
+            fill_student_sheet(
+                ws, rnd,
+                rnd.randint(1, max_rows), rnd.randint(0, max_rows // 4),
+                rnd.random() < tick_rate, zero_rate
+            )
+
+        path = os.path.join(folder, f"class_{file_idx + 1:03d}.xlsx")
+        wb.save(path)
+        if shared_strings:
+            convert_to_shared_strings(path)
+        paths.append(path)
+    return paths
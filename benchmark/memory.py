@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from benchmark.corpus import generate_corpus
+
+# Checks that a bounded-memory merge keeps a flat memory profile: the same merge is run over
+# corpora of growing size, each in a fresh interpreter, and the peak RSS of the largest run
+# must stay within a tolerance of the smallest one. With --workers > 1 the parsing happens in
+# pool processes, so the largest worker's peak RSS is checked the same way.
+#
+#   python -m benchmark.memory --files 5,20,80 --memory-limit 400
+
+# Merge run in the child interpreter; prints its own and its pool workers' peak RSS as JSON on the
+# last line. merge_folder shuts the pool down, so the workers have been waited for; as they reset
+# their peak for every workbook, their per-file peaks are counted too.
+CHILD_SCRIPT = """
+import contextlib, io, json, sys
+import olemerge
+from olemetrics import RunMetrics, peak_rss_bytes
+folder, workers, memory_limit, reader = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), sys.argv[4]
+metrics = RunMetrics()
+with contextlib.redirect_stdout(io.StringIO()):
+    olemerge.merge_folder(folder, olemerge.DEFAULT_TASKS, workers=workers, reader=reader,
+                          memory_limit=memory_limit, metrics=metrics)
+workers_peak = peak_rss_bytes(children=True)
+if workers_peak is not None and workers > 1:
+    workers_peak = max([workers_peak] + [record['peak_rss'] or 0 for record in metrics.files])
+print(json.dumps({'peak_rss': peak_rss_bytes(), 'workers_peak_rss': workers_peak}))
+"""
+
+# Function to merge one folder in a fresh interpreter, returning its peak RSS and its largest
+# worker's (0 without workers, None where it cannot be read) in bytes
+def measure_peak_rss(folder, workers, memory_limit, reader):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT, folder, str(workers), str(memory_limit), reader],
+        cwd=root, capture_output=True, text=True, check=True
+    ).stdout
+    peaks = json.loads(output.strip().splitlines()[-1])
+    return peaks['peak_rss'], peaks['workers_peak_rss']
+
+# Function to measure the peak RSS at each corpus size, returning [(files, peak_rss, workers_peak_rss)]
+def run_memory_check(file_counts, sheets=30, workers=1, memory_limit=400, reader="openpyxl", seed=0):
+    base = tempfile.mkdtemp(prefix="olemerge-memory-")
+    results = []
+    try:
+        for files in file_counts:
+            folder = os.path.join(base, f"corpus_{files}")
+            generate_corpus(folder, files=files, sheets=sheets, seed=seed)
+            peak, workers_peak = measure_peak_rss(folder, workers, memory_limit * 1024 * 1024, reader)
+            results.append((files, peak, workers_peak))
+            line = f"{files:>6} files  peak RSS {peak / 1024 / 1024:.1f} MB"
+            if workers_peak:
+                line += f"  largest worker {workers_peak / 1024 / 1024:.1f} MB"
+            print(line)
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmark.memory",
+                                     description="Check that a bounded-memory merge has a flat memory profile")
+    parser.add_argument("--files", default="5,20,60", help="comma separated corpus sizes, in workbooks")
+    parser.add_argument("--sheets", type=int, default=30, help="student sheets per workbook")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--memory-limit", type=int, default=400, metavar="MB")
+    parser.add_argument("--reader", choices=["openpyxl", "xml"], default="openpyxl")
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="largest allowed ratio of the biggest run's peak RSS to the smallest's")
+    args = parser.parse_args(argv)
+
+    results = run_memory_check([int(count) for count in args.files.split(",")], args.sheets,
+                               args.workers, args.memory_limit, args.reader)
+    # The parent and, when the parsing ran in pool workers, the largest worker must both stay flat
+    checks = [("Peak RSS", results[0][1], results[-1][1])]
+    if args.workers > 1:
+        if not results[0][2]:
+            print("Cannot read the workers' peak RSS on this platform")
+            return 1
+        checks.append(("Worker peak RSS", results[0][2], results[-1][2]))
+    status = 0
+    for label, smallest, largest in checks:
+        ratio = largest / smallest
+        if ratio > args.tolerance:
+            print(f"{label} grew {ratio:.2f}x with the corpus (allowed {args.tolerance:.2f}x)")
+            status = 1
+        else:
+            print(f"{label} flat: {ratio:.2f}x across corpus sizes")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+import openpyxl
+from openpyxl import load_workbook, Workbook
+import olemerge
+import xlsxrange
+from benchmark.corpus import generate_corpus
+
+# Stage timings of the merge at several corpus sizes, recorded as JSON so runs can be compared.
+# Everything runs headless: only olemerge and openpyxl are imported, never tkinter.
+
+STAGES = ["discovery", "open", "extract", "transform", "write", "merge_folder"]
+
+# Function to time a callable, returning (seconds, result)
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+# Function to open and close every workbook without reading any sheet data
+def open_only(file_paths, reader):
+    for file_path in file_paths:
+        if reader == "xml":
+            with zipfile.ZipFile(file_path) as archive:
+                xlsxrange.read_workbook_info(archive)
+        else:
+            wb = load_workbook(file_path, read_only=True, data_only=True)
+            wb.sheetnames
+            wb.close()
+
+# Function to run every transform chain over the extracted rows, without writing them
+def transform_only(tasks, extracted):
+    scratch = Workbook(write_only=True).create_sheet()
+    count = 0
+    for task in tasks:
+        for results in extracted:
+            for sheet_name, rows in results[task['name']]:
+                for values in rows:
+                    row = list(values) + [None] * max(19 - len(values), 0)
+                    row[18] = sheet_name
+                    for transform in task['transforms']:
+                        row = transform(row, scratch)
+                    count += 1
+    return count
+
+# Function to write the extracted rows with the transforms switched off
+def write_only(tasks, plans, extracted, output_folder):
+    for task, plan in zip(tasks, plans):
+        merge_wb = Workbook(write_only=True)
+        writer = olemerge.MergeSheetWriter(merge_wb, dict(task, transforms=[]), plan)
+        for results in extracted:
+            for sheet_name, rows in results[task['name']]:
+                for values in rows:
+                    writer.append(values, sheet_name)
+        writer.close()
+        merge_wb.save(os.path.join(output_folder, f"bench_{task['name']}.xlsx"))
+
+# Function to time each stage of a merge over one corpus folder
+def benchmark_folder(folder, tasks, reader="openpyxl", workers=1):
+    plans = olemerge.build_plans(tasks)
+    stages = {}
+
+    stages["discovery"], file_paths = timed(olemerge.list_source_files, folder, olemerge.merge_filenames(folder, tasks))
+    stages["open"], _ = timed(open_only, file_paths, reader)
+    stages["extract"], extracted = timed(
+        lambda: [olemerge.extract_workbook(path, plans, reader) for path in file_paths]
+    )
+    stages["transform"], rows = timed(transform_only, tasks, extracted)
+
+    with tempfile.TemporaryDirectory() as output_folder:
+        stages["write"], _ = timed(write_only, tasks, plans, extracted, output_folder)
+
+    # End to end, with the per-file progress output silenced
+    with contextlib.redirect_stdout(io.StringIO()):
+        stages["merge_folder"], merge_paths = timed(
+            olemerge.merge_folder, folder, tasks, workers=workers, reader=reader
+        )
+    for path in merge_paths.values():
+        os.remove(path)
+
+    return {
+        "files": len(file_paths),
+        "bytes": sum(os.path.getsize(path) for path in file_paths),
+        "rows": rows,
+        "stages": {stage: round(seconds, 4) for stage, seconds in stages.items()},
+    }
+
+# Function to run the benchmark for each corpus size ("FILESxSHEETS") and reader
+def run_suite(sizes, readers, workers=1, seed=0, work_dir=None):
+    results = {
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "openpyxl": openpyxl.__version__,
+        "cpu_count": os.cpu_count(),
+        "workers": workers,
+        "runs": [],
+    }
+    base = work_dir or tempfile.mkdtemp(prefix="olemerge-bench-")
+    try:
+        for size in sizes:
+            files, sheets = (int(part) for part in size.lower().split("x"))
+            folder = os.path.join(base, f"corpus_{files}x{sheets}")
+            if not os.path.isdir(folder):
+                generate_corpus(folder, files=files, sheets=sheets, seed=seed)
+            for reader in readers:
+                run = benchmark_folder(folder, olemerge.DEFAULT_TASKS, reader, workers)
+                run.update({"size": size, "reader": reader})
+                results["runs"].append(run)
+                print(f"{size:>8} {reader:>8}  " + "  ".join(
+                    f"{stage}={run['stages'][stage]:.3f}s" for stage in STAGES
+                ))
+    finally:
+        if work_dir is None:
+            shutil.rmtree(base, ignore_errors=True)
+    return results
+
+# Function to compare two result files, returning a line per matching (size, reader, stage)
+def compare_results(old, new):
+    old_runs = {(run["size"], run["reader"]): run for run in old["runs"]}
+    lines = []
+    for run in new["runs"]:
+        before = old_runs.get((run["size"], run["reader"]))
+        if before is None:
+            continue
+        for stage in STAGES:
+            old_time = before["stages"].get(stage)
+            new_time = run["stages"].get(stage)
+            if old_time and new_time is not None:
+                lines.append(
+                    f"{run['size']:>8} {run['reader']:>8} {stage:>12}: "
+                    f"{old_time:.3f}s -> {new_time:.3f}s ({new_time / old_time:.2f}x)"
+                )
+    return lines
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="Benchmark the OLE/Displine merge")
+    parser.add_argument("--sizes", default="2x5,10x30", help="comma separated FILESxSHEETS corpus sizes")
+    parser.add_argument("--reader", action="append", choices=["openpyxl", "xml"],
+                        help="reader to benchmark (repeatable, default both)")
+    parser.add_argument("--workers", type=int, default=1, help="workers for the end-to-end merge_folder stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", help="keep generated corpora here instead of a temporary folder")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.sizes.split(","), args.reader or ["openpyxl", "xml"],
+                        args.workers, args.seed, args.work_dir)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            for line in compare_results(json.load(f), results):
+                print(line)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
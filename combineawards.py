@@ -1,7 +1,10 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import openpyxl
-from openpyxl.styles import PatternFill
+from olecombine import make_combine_spec, CombineJob
+
+# How often the window checks on the combine worker, in milliseconds
+POLL_MS = 100
 
 class ExcelProcessorGUI:
     def __init__(self, root):
@@ -38,7 +41,17 @@ class ExcelProcessorGUI:
             self.entries.append(entry)
         
         # Process button
-        ttk.Button(main_frame, text="Process Excel", command=self.process_excel).grid(row=7, column=0, columnspan=3, pady=20)
+        self.process_button = ttk.Button(main_frame, text="Process Excel", command=self.process_excel)
+        self.process_button.grid(row=7, column=0, columnspan=3, pady=20)
+        
+        # Progress of the combine, which runs in a worker process, and its Cancel button
+        self.status = tk.StringVar()
+        ttk.Label(main_frame, textvariable=self.status).grid(row=8, column=0, columnspan=2, sticky=tk.W)
+        self.progress_bar = ttk.Progressbar(main_frame, mode="indeterminate", length=200)
+        self.progress_bar.grid(row=9, column=0, columnspan=2, sticky=tk.W, pady=5)
+        self.cancel_button = ttk.Button(main_frame, text="Cancel", command=self.cancel_job, state="disabled")
+        self.cancel_button.grid(row=9, column=2, pady=5)
+        self.job = None
 
     def browse_file(self):
         filename = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx;*.xls")])
@@ -48,7 +61,7 @@ class ExcelProcessorGUI:
 
     def update_sheet_list(self):
         try:
-            wb = openpyxl.load_workbook(self.file_path.get())
+            wb = openpyxl.load_workbook(self.file_path.get(), read_only=True)
             sheet_names = wb.sheetnames
             self.sheet_combobox['values'] = sheet_names
             self.sheet_combobox.set(sheet_names[0])  # Set default value to first sheet
@@ -56,12 +69,6 @@ class ExcelProcessorGUI:
         except Exception as e:
             messagebox.showerror("Error", f"Error loading Excel file:\n{str(e)}")
 
-    def safe_get_value(self, cell):
-        """Safely get cell value, converting to string and handling None"""
-        if cell.value is None:
-            return ""
-        return str(cell.value).strip()
-
     def process_excel(self):
         try:
             # Get values from GUI
@@ -69,72 +76,57 @@ class ExcelProcessorGUI:
             sheet_name = self.sheet_combobox.get()
             col_indices = [int(entry.get()) - 1 for entry in self.entries]  # Convert to 0-based indices
             
-            # Load workbook
-            wb = openpyxl.load_workbook(file_path)
-            ws = wb[sheet_name]
-            
-            # Create dictionary to store groups
-            groups = {}
-            yellow_fill = PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid')
-            
-            # First pass: identify groups and collect data
-            rows_to_delete = set()
-            for row_idx, row in enumerate(ws.iter_rows(min_row=2), start=2):  # Skip header row
-                # Safely get values with error handling
-                try:
-                    class_name = self.safe_get_value(row[col_indices[0]]).lower()
-                    class_num = self.safe_get_value(row[col_indices[1]])
-                    group_criteria = self.safe_get_value(row[col_indices[2]])
-                    
-                    # Skip completely empty rows
-                    if not any([class_name, class_num, group_criteria]):
-                        continue
-                        
-                    key = (class_name, class_num, group_criteria)
-                    
-                    if key not in groups:
-                        groups[key] = {
-                            'values': [self.safe_get_value(row[col_indices[3]])],
-                            'first_row': row_idx,
-                            'rows_to_combine': [row_idx]
-                        }
-                    else:
-                        groups[key]['values'].append(self.safe_get_value(row[col_indices[3]]))
-                        groups[key]['rows_to_combine'].append(row_idx)
-                        rows_to_delete.add(row_idx)
-                except IndexError:
-                    messagebox.showerror("Error", f"Row {row_idx} has fewer columns than specified. Please check your column indices.")
-                    return
-                except Exception as e:
-                    messagebox.showerror("Error", f"Error processing row {row_idx}: {str(e)}")
-                    return
-            
-            # Second pass: combine values and delete rows
-            for key, group_data in groups.items():
-                if len(group_data['values']) > 1:
-                    # Combine non-empty values
-                    combined_value = ', '.join(v for v in group_data['values'] if v)
-                    first_row = group_data['first_row']
-                    
-                    # Update the combined value
-                    ws.cell(row=first_row, column=col_indices[3] + 1).value = combined_value
-                    
-                    # Color the entire row yellow
-                    for cell in ws[first_row]:
-                        cell.fill = yellow_fill
-            
-            # Delete rows from bottom to top to avoid shifting issues
-            for row_idx in sorted(rows_to_delete, reverse=True):
-                ws.delete_rows(row_idx)
-            
-            # Save the workbook
-            output_path = file_path.rsplit('.', 1)[0] + '_processed.xlsx'
-            wb.save(output_path)
-            
-            messagebox.showinfo("Success", f"Processing complete!\nSaved as: {output_path}")
-            
+            # Group the rows and write the combined sheet in a worker process, polled from here
+            spec = make_combine_spec(col_indices, key_style="text")
+            self.job = CombineJob(file_path, sheet_name, spec)
         except Exception as e:
             messagebox.showerror("Error", f"An error occurred:\n{str(e)}")
+            return
+        
+        self.process_button.configure(state="disabled")
+        self.cancel_button.configure(state="normal")
+        self.status.set("Loading workbook...")
+        self.progress_bar.start()
+        self.root.after(POLL_MS, self.check_job, self.job)
+
+    def check_job(self, job):
+        if job is not self.job:
+            return
+        for message in job.poll():
+            kind = message[0]
+            if kind == "scanned":
+                self.status.set(f"Scanned {message[1]} rows...")
+            elif kind == "groups":
+                self.status.set(f"Found {message[1]} groups, writing...")
+            elif kind == "written":
+                self.status.set(f"Wrote {message[1]} rows")
+            elif kind == "done":
+                self.finish_job()
+                messagebox.showinfo("Success", f"Processing complete!\nSaved as: {message[1]}")
+            elif kind == "row_error":
+                _, row_idx, index_error, error = message
+                self.finish_job()
+                if index_error:
+                    messagebox.showerror("Error", f"Row {row_idx} has fewer columns than specified. Please check your column indices.")
+                else:
+                    messagebox.showerror("Error", error)
+            else:
+                self.finish_job()
+                messagebox.showerror("Error", f"An error occurred:\n{message[1]}")
+        if not job.finished:
+            self.root.after(POLL_MS, self.check_job, job)
+
+    def cancel_job(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.finish_job()
+            self.status.set("Cancelled")
+
+    def finish_job(self):
+        self.job = None
+        self.progress_bar.stop()
+        self.process_button.configure(state="normal")
+        self.cancel_button.configure(state="disabled")
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,175 @@
+import os
+import datetime
+import hashlib
+import json
+import sqlite3
+
+# Cache file kept next to the source workbooks
+CACHE_FILENAME = ".olemerge_cache.sqlite"
+
+# Checkpoint journal of an unfinished run, kept next to the source workbooks until the run completes
+JOURNAL_FILENAME = ".olemerge_journal.sqlite"
+
+# Function to hash a file's content
+def file_sha256(file_path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Schema version kept in the SQLite user_version; files of another version are emptied on open
+CACHE_VERSION = 2
+
+# Cell values JSON cannot hold, tagged as {"$<tag>": text} (datetime before date, its base class)
+TAGGED_TYPES = (
+    ("datetime", datetime.datetime, datetime.datetime.fromisoformat),
+    ("date", datetime.date, datetime.date.fromisoformat),
+    ("time", datetime.time, datetime.time.fromisoformat),
+)
+
+# Function to encode a cell value that is not plain JSON
+def encode_value(value):
+    for tag, value_type, _ in TAGGED_TYPES:
+        if isinstance(value, value_type):
+            return {"$" + tag: value.isoformat()}
+    if isinstance(value, datetime.timedelta):
+        return {"$timedelta": [value.days, value.seconds, value.microseconds]}
+    raise TypeError(f"Cannot cache a cell value of type {type(value).__name__}")
+
+# Function to decode a tagged cell value written by encode_value
+def decode_value(obj):
+    for tag, _, parse in TAGGED_TYPES:
+        if "$" + tag in obj:
+            return parse(obj["$" + tag])
+    if "$timedelta" in obj:
+        return datetime.timedelta(*obj["$timedelta"])
+    return obj
+
+# Function to serialise one task's sheets, [(sheet name, [row tuple, ...]), ...], as JSON.
+# JSON rather than pickle, since the cache sits in a shared folder and loading it must not run code.
+def dump_sheets(sheets):
+    return json.dumps(sheets, default=encode_value, separators=(",", ":"))
+
+# Function to read back sheets written by dump_sheets, with the rows as tuples again
+def load_sheets(text):
+    return [(sheet_name, [tuple(row) for row in rows])
+            for sheet_name, rows in json.loads(text, object_hook=decode_value)]
+
+# Function to turn a plan into a stable key, so changing a range or rule invalidates its entries
+def plan_key(plan):
+    return repr(sorted(plan.items()))
+
+# Class to persist each workbook's extracted rows per task, keyed by path, size, mtime and content hash
+class ExtractionCache:
+    filename = CACHE_FILENAME
+
+    def __init__(self, target_folder):
+        self.path = os.path.join(target_folder, self.filename)
+        self.conn = sqlite3.connect(self.path)
+        # Entries of an older version (pickled rows) are never read, only dropped
+        (version,) = self.conn.execute("PRAGMA user_version").fetchone()
+        if version != CACHE_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS extractions")
+            self.conn.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS extractions ("
+            " filename TEXT, plan_key TEXT, size INTEGER, mtime_ns INTEGER, sha256 TEXT, sheets TEXT,"
+            " PRIMARY KEY (filename, plan_key))"
+        )
+        self.hits = 0
+        self.misses = 0
+
+    # Check whether every plan of one file has an up-to-date entry, without loading the rows
+    def is_fresh(self, file_path, plans):
+        filename = os.path.basename(file_path)
+        stat = os.stat(file_path)
+        sha256 = None
+        for plan in plans:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, sha256 FROM extractions WHERE filename = ? AND plan_key = ?",
+                (filename, plan_key(plan))
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return False
+            size, mtime_ns, cached_sha256 = row
+            if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+                # Sync clients touch mtimes without changing content, so fall back to the hash
+                if sha256 is None:
+                    sha256 = file_sha256(file_path)
+                if sha256 != cached_sha256:
+                    self.misses += 1
+                    return False
+                self.conn.execute(
+                    "UPDATE extractions SET size = ?, mtime_ns = ? WHERE filename = ? AND plan_key = ?",
+                    (stat.st_size, stat.st_mtime_ns, filename, plan_key(plan))
+                )
+        self.hits += 1
+        return True
+
+    # Load the cached rows of one file, {task name: sheets}; call only after is_fresh
+    def load(self, file_path, plans):
+        filename = os.path.basename(file_path)
+        results = {}
+        for plan in plans:
+            (sheets,) = self.conn.execute(
+                "SELECT sheets FROM extractions WHERE filename = ? AND plan_key = ?",
+                (filename, plan_key(plan))
+            ).fetchone()
+            results[plan['name']] = load_sheets(sheets)
+        return results
+
+    # Look up every plan for one file; returns {task name: sheets} or None if any plan is stale
+    def lookup(self, file_path, plans):
+        if not self.is_fresh(file_path, plans):
+            return None
+        return self.load(file_path, plans)
+
+    # Store a freshly extracted file for every plan; stat and sha256 should be taken before extraction started
+    def store(self, file_path, plans, results, stat=None, sha256=None):
+        filename = os.path.basename(file_path)
+        if stat is None:
+            stat = os.stat(file_path)
+        if sha256 is None:
+            sha256 = file_sha256(file_path)
+        for plan in plans:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?, ?)",
+                (filename, plan_key(plan), stat.st_size, stat.st_mtime_ns, sha256,
+                 dump_sheets(results[plan['name']]))
+            )
+
+    # Drop entries of workbooks that are no longer in the folder
+    def prune(self, file_paths):
+        current = {os.path.basename(path) for path in file_paths}
+        for (filename,) in self.conn.execute("SELECT DISTINCT filename FROM extractions").fetchall():
+            if filename not in current:
+                self.conn.execute("DELETE FROM extractions WHERE filename = ?", (filename,))
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+# Class to journal a checkpointed run: every extracted workbook is committed as soon as it is
+# stored, so a run that dies halfway can be resumed from the files already done. Entries are
+# checked like cache entries, so a workbook changed since it was journaled is extracted again.
+class CheckpointJournal(ExtractionCache):
+    filename = JOURNAL_FILENAME
+
+    # Open the journal; unless resuming, entries of an earlier run are discarded
+    def __init__(self, target_folder, resume=False):
+        super().__init__(target_folder)
+        if not resume:
+            self.conn.execute("DELETE FROM extractions")
+            self.conn.commit()
+
+    def store(self, file_path, plans, results, stat=None, sha256=None):
+        super().store(file_path, plans, results, stat, sha256)
+        self.conn.commit()
+
+    # Close the journal; a completed run deletes it, an incomplete one leaves it for --resume
+    def close(self, completed=False):
+        super().close()
+        if completed:
+            os.remove(self.path)
@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import sys
+import olemerge
+from olecombine import combine_spec_from_letters
+from olemetrics import RunMetrics, profile_run
+from olewatch import watch_folder
+
+# Headless entry point for the OLE/Displine merge, for cron jobs and servers.
+# Only olemerge and openpyxl are loaded; tkinter and pandas are never imported.
+#
+#   python olecli.py "D:/OLE 2024-25" --workers 4 --reader xml
+#   python olecli.py "D:/OLE 2024-25" --task OLE:cv26:dm205:cv26:cv205 --task Displine:bb26:bj205:bb26:bb205
+#   python olecli.py "D:/OLE 2024-25" --config merge.json --report run
+#   python olecli.py "D:/OLE 2024-25" --watch
+#   python olecli.py "D:/OLE 2024-25" --combine OLE:S:B:A:C
+#
+# Exit status: 0 when every workbook merged, 1 when a workbook failed or an output could not be
+# saved, 2 on bad arguments.
+
+EXIT_OK = 0
+EXIT_FILE_ERRORS = 1
+EXIT_USAGE = 2
+
+# Sheets whose unchanged copies --dedup skips
+DEDUP_TEMPLATE_SHEETS = ["TEMPLATE"]
+
+# Function to turn a config file task entry into a task spec; "combine" lists the four combine columns
+def task_from_config(entry, zero_marking="fill", template_sheets=(), combine=None):
+    columns = (combine or {}).get(entry['name'], entry.get('combine'))
+    return olemerge.make_task(
+        entry['name'],
+        entry['process_range'],
+        entry.get('criteria_range'),
+        concat_columns=entry.get('concat_columns', ["P", "I"] if entry['name'] == "Displine" else ["P"]),
+        row_selection=entry.get('row_selection', "criteria"),
+        excluded_sheets=entry.get('excluded_sheets', olemerge.EXCLUDED_SHEETS),
+        probes=[tuple(probe) for probe in entry.get('probes', [])],
+        zero_marking=entry.get('zero_marking', zero_marking),
+        template_sheets=entry.get('template_sheets', template_sheets),
+        combine=combine_spec_from_letters(columns) if columns else None,
+    )
+
+# Function to parse --task NAME:PROCESS_START:PROCESS_END[:CRITERIA_START:CRITERIA_END]
+def task_from_argument(value):
+    parts = value.split(':')
+    if len(parts) not in (3, 5):
+        raise argparse.ArgumentTypeError(f"expected NAME:START:END[:CRIT_START:CRIT_END], got {value!r}")
+    entry = {'name': parts[0], 'process_range': f"{parts[1]}:{parts[2]}"}
+    if len(parts) == 5:
+        entry['criteria_range'] = f"{parts[3]}:{parts[4]}"
+    return entry
+
+# Function to parse --combine TASK:NAME_COL:NUMBER_COL:GROUP_COL:VALUE_COL into (task, column letters)
+def combine_from_argument(value):
+    parts = value.split(':')
+    if len(parts) != 5 or not all(part.isalpha() for part in parts[1:]):
+        raise argparse.ArgumentTypeError(f"expected TASK:NAME:NUMBER:GROUP:VALUE column letters, got {value!r}")
+    return parts[0], parts[1:]
+
+# Function to load a JSON config: {"tasks": [...], "workers": 4, "reader": "xml", "use_cache": true, ...}
+def load_config(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Merge OLE/Displine ranges from every class workbook in a folder")
+    parser.add_argument("target_folder", help="folder with the class workbooks")
+    parser.add_argument("--config", help="JSON file with tasks and options; command-line options win")
+    parser.add_argument("--task", action="append", type=task_from_argument,
+                        help="NAME:START:END[:CRIT_START:CRIT_END], repeatable (default: OLE and Displine)")
+    parser.add_argument("--workers", type=int, help="worker processes, 0 for one per CPU (default 1)")
+    parser.add_argument("--reader", choices=["openpyxl", "xml"], help="sheet reader (default openpyxl)")
+    parser.add_argument("--cache", dest="use_cache", action="store_true", default=None,
+                        help="reuse extractions of unchanged workbooks")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false")
+    parser.add_argument("--memory-limit", type=int, metavar="MB",
+                        help="keep the run under this much memory by streaming and throttling workers")
+    parser.add_argument("--prefetch", type=int, metavar="K",
+                        help="read the next K workbooks into memory while parsing, for slow or synced folders")
+    parser.add_argument("--split-mb", type=int, metavar="MB",
+                        help="split workbooks of this size or more by sheet across workers (default 8, 0 to never)")
+    parser.add_argument("--zero-marking", choices=olemerge.ZERO_MARKINGS,
+                        help="mark blanked zeros with a fill per cell or one conditional format per sheet (default fill)")
+    parser.add_argument("--checkpoint", action="store_true", default=None,
+                        help="journal each finished workbook so an interrupted run can be resumed")
+    parser.add_argument("--resume", action="store_true", default=None,
+                        help="continue an interrupted --checkpoint run, skipping the workbooks already done")
+    parser.add_argument("--dedup", action="store_true", default=None,
+                        help="merge identical workbooks once and skip unchanged copies of the TEMPLATE sheet")
+    parser.add_argument("--timeout", type=float, metavar="SECONDS",
+                        help="extract each workbook in its own process and give up on it after this long")
+    parser.add_argument("--worker-memory", type=int, metavar="MB",
+                        help="extract each workbook in its own process, stopped once it uses this much more memory")
+    parser.add_argument("--retry-reader", choices=["openpyxl", "xml"],
+                        help="with --timeout/--worker-memory, retry failed workbooks once with this reader")
+    parser.add_argument("--combine", action="append", type=combine_from_argument,
+                        help="TASK:NAME:NUMBER:GROUP:VALUE, fold the task's rows with the same class name, number "
+                             "and grouping while merging, into merge_<task>_processed.xlsx (repeatable)")
+    parser.add_argument("--combined", help="write every task into this one workbook instead of merge_<task>.xlsx")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and merge again whenever a workbook changes (implies --cache)")
+    parser.add_argument("--poll", action="store_true", help="with --watch, poll the folder instead of using inotify")
+    parser.add_argument("--debounce", type=float, default=2.0,
+                        help="with --watch, seconds without changes before merging again (default 2)")
+    parser.add_argument("--report", help="write a run report to REPORT.json, REPORT.csv and REPORT_failures.csv")
+    parser.add_argument("--profile", choices=["cprofile", "sample"], help="profile the run, output next to --report")
+    parser.add_argument("--quiet", action="store_true", help="only print errors and the summary")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.target_folder):
+        print(f"Target folder not found: {args.target_folder}", file=sys.stderr)
+        return EXIT_USAGE
+
+    try:
+        config = load_config(args.config) if args.config else {}
+        zero_marking = args.zero_marking or config.get('zero_marking', "fill")
+        dedup = args.dedup if args.dedup is not None else config.get('dedup', False)
+        template_sheets = DEDUP_TEMPLATE_SHEETS if dedup else ()
+        entries = args.task or config.get('tasks')
+        combine = dict(args.combine or [])
+        if not entries:
+            entries = [{'name': task['name'], 'process_range': task['process_range'],
+                        'criteria_range': task['criteria_range']} for task in olemerge.DEFAULT_TASKS]
+        tasks = [task_from_config(entry, zero_marking, template_sheets, combine) for entry in entries]
+        unknown = set(combine) - {task['name'] for task in tasks}
+        if unknown:
+            raise ValueError(f"--combine names unknown tasks: {', '.join(sorted(unknown))}")
+        olemerge.build_plans(tasks)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Invalid configuration: {e}", file=sys.stderr)
+        return EXIT_USAGE
+
+    def option(name, default):
+        value = getattr(args, name)
+        return config.get(name, default) if value is None else value
+
+    workers = option('workers', 1)
+    options = {
+        'workers': None if workers == 0 else workers,
+        'reader': option('reader', "openpyxl"),
+        'use_cache': option('use_cache', False),
+        'prefetch': option('prefetch', 0),
+        'checkpoint': option('checkpoint', False),
+        'resume': option('resume', False),
+        'skip_duplicates': dedup,
+        'combined_path': args.combined or config.get('combined_path'),
+    }
+    split_mb = option('split_mb', None)
+    if split_mb is not None:
+        options['split_bytes'] = split_mb * 1024 * 1024
+    memory_limit = option('memory_limit', None)
+    if memory_limit:
+        options['memory_limit'] = memory_limit * 1024 * 1024
+    timeout = option('timeout', None)
+    worker_memory = option('worker_memory', None)
+    if worker_memory and not olemerge.memory_cap_supported():
+        print("--worker-memory needs psutil installed on this platform", file=sys.stderr)
+        return EXIT_USAGE
+    if timeout or worker_memory:
+        options['isolation'] = olemerge.make_isolation(
+            timeout, worker_memory * 1024 * 1024 if worker_memory else None, option('retry_reader', None)
+        )
+
+    if not args.watch:
+        return run_merge(args, tasks, options)
+
+    # Only changed workbooks are parsed again, and the merges' own renames are not changes
+    options['use_cache'] = True
+    ignored = olemerge.merge_filenames(args.target_folder, tasks, options['combined_path'])
+    if options['combined_path']:
+        ignored.add(os.path.basename(options['combined_path']))
+    watch_folder(args.target_folder, lambda: run_merge(args, tasks, options), args.debounce,
+                 ignored=ignored, polling=args.poll)
+    return EXIT_OK
+
+# Function to run one merge with the parsed options, print its summary and return the exit status
+def run_merge(args, tasks, options):
+    metrics = RunMetrics()
+    run_args = (args.target_folder, tasks)
+    run_kwargs = dict(options, metrics=metrics)
+
+    stdout = sys.stdout
+    if args.quiet:
+        sys.stdout = open(os.devnull, "w")
+    try:
+        if args.profile:
+            prefix = args.report or os.path.join(args.target_folder, "merge_profile")
+            merge_paths = profile_run(args.profile, prefix, olemerge.merge_folder, *run_args, **run_kwargs)
+        else:
+            merge_paths = olemerge.merge_folder(*run_args, **run_kwargs)
+    finally:
+        if args.quiet:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    if args.report:
+        metrics.write_json(f"{args.report}.json")
+        metrics.write_csv(f"{args.report}.csv")
+        metrics.write_failures(f"{args.report}_failures.csv")
+
+    for record in metrics.files:
+        if record['error']:
+            retried = " (after a retry)" if record['retried'] else ""
+            print(f"Failed{retried}: {record['file']}: {record['error']}", file=sys.stderr)
+    for task_name, path in merge_paths.items():
+        print(f"{task_name}: {path}")
+    print(f"{metrics.run['files']} files, {metrics.run['rows']} rows, "
+          f"{metrics.run['failed_files']} failed, {metrics.run['elapsed']:.1f}s")
+    if metrics.skips:
+        print(f"Skipped {metrics.run['skipped_files']} duplicate files and "
+              f"{metrics.run['skipped_sheets']} unchanged template sheets")
+
+    if metrics.run['failed_saves']:
+        print("Some merged workbooks could not be saved", file=sys.stderr)
+    for record in metrics.combine_failures:
+        print(f"Could not combine {record['task']}, saved uncombined: {record['error']}", file=sys.stderr)
+    if metrics.run['failed_files'] or metrics.run['failed_saves'] or metrics.run['failed_combines']:
+        return EXIT_FILE_ERRORS
+    return EXIT_OK
+
+if __name__ == "__main__":
+    sys.exit(main())
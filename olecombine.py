@@ -0,0 +1,718 @@
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+from bisect import bisect_left
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from fnmatch import fnmatchcase
+import numpy as np
+from openpyxl import load_workbook
+from openpyxl.cell import Cell, WriteOnlyCell
+from openpyxl.styles import PatternFill
+from openpyxl.utils import column_index_from_string
+from olemerge import add_highlight_rule, MergeSheetWriter, temporary_path
+
+# Combining of merged award rows: rows with the same class name, class number and grouping
+# criteria are folded into the first of them, their values joined with ", ", and the first row
+# is highlighted. Shared by the combine GUIs in OLE-finalv4.py and combineawards.py, and run on
+# its own to combine many workbooks at once:
+#
+#   python olecombine.py "D:/Merges/*.xlsx" --columns S,B,A,C
+#   python olecombine.py "D:/Merges" --columns 1,2,3,4 --text-keys --sheet "Merged Data *" --report year_end
+#
+# Exit status: 0 when every sheet combined, 1 when a workbook or sheet failed, 2 on bad arguments.
+
+YELLOW_FILL = PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid')
+
+# How key cells are compared: "raw" compares the values as they are (OLE-finalv4.py), "text"
+# compares them as stripped text (combineawards.py)
+KEY_STYLES = ("raw", "text")
+
+# Function to build a combine spec from the 0-based indices of the class name, class number,
+# grouping criteria and values-to-combine columns
+def make_combine_spec(col_indices, key_style="raw"):
+    if len(col_indices) != 4:
+        raise ValueError("Expected four columns: class name, class number, grouping criteria and values")
+    if key_style not in KEY_STYLES:
+        raise ValueError(f"Unknown key style: {key_style}")
+    return {'columns': list(col_indices), 'key_style': key_style}
+
+# Function to build a combine spec from column letters, as the combine GUI of OLE-finalv4.py takes them
+def combine_spec_from_letters(letters, key_style="raw"):
+    return make_combine_spec([column_index_from_string(letter.strip().upper()) - 1 for letter in letters], key_style)
+
+# Error of one data row, raised before anything is changed
+class CombineRowError(Exception):
+    def __init__(self, row_idx, error):
+        super().__init__(f"Error processing row {row_idx}: {str(error)}")
+        self.row_idx = row_idx
+        self.error = error
+
+# Function to get a cell value as stripped text, "" for an empty cell
+def text_value(value):
+    if value is None:
+        return ""
+    return str(value).strip()
+
+# Function to get a row's group key and value, or None for a row whose key cells are all empty
+def row_key_value(row, spec):
+    name_col, num_col, group_col, value_col = spec['columns']
+    if spec['key_style'] == "text":
+        class_name = text_value(row[name_col]).lower()
+        class_num = text_value(row[num_col])
+        group_criteria = text_value(row[group_col])
+    else:
+        class_name = row[name_col].lower() if row[name_col] else ""
+        class_num = row[num_col]
+        group_criteria = row[group_col]
+
+    if not any([class_name, class_num, group_criteria]):
+        return None
+    value = row[value_col]
+    if spec['key_style'] == "text":
+        value = text_value(value)
+    return (class_name, class_num, group_criteria), value
+
+# Element-wise operations over object arrays, with Python's own semantics for every cell value
+truth = np.frompyfunc(bool, 1, 1)
+is_text = np.frompyfunc(lambda value: isinstance(value, str), 1, 1)
+lower = np.frompyfunc(str.lower, 1, 1)
+as_text = np.frompyfunc(text_value, 1, 1)
+
+# Function to load the four combine columns of a worksheet's data rows as object arrays.
+# Returns (count, columns, width); a column outside the sheet is None, as no row can be read there.
+def read_combine_columns(ws, spec):
+    width = ws.max_column
+    count = max(ws.max_row - 1, 0)
+    columns = []
+    for col in spec['columns']:
+        index = col + width if col < 0 else col
+        if not 0 <= index < width:
+            columns.append(None)
+            continue
+        array = np.empty(count, dtype=object)
+        if count:
+            array[:] = next(ws.iter_cols(min_col=index + 1, max_col=index + 1, min_row=2, values_only=True))
+        columns.append(array)
+    return count, columns, width
+
+# Function to get a merged value as it reads back from the saved merge: cells written for their
+# style give their value, and empty strings are not stored at all
+def stored_value(value):
+    if isinstance(value, Cell):
+        value = value.value
+    return None if value == "" else value
+
+# Function to gather the four combine columns of rows held in memory, in the form read_combine_columns
+# returns them. Rows shorter than width count as padded with empty cells; convert, when given, is
+# applied to every value read.
+def columns_from_rows(rows, spec, width, convert=stored_value):
+    count = len(rows)
+    columns = []
+    for col in spec['columns']:
+        index = col + width if col < 0 else col
+        if not 0 <= index < width:
+            columns.append(None)
+            continue
+        array = np.empty(count, dtype=object)
+        if convert is None:
+            array[:] = [row[index] if index < len(row) else None for row in rows]
+        else:
+            array[:] = [convert(row[index]) if index < len(row) else None for row in rows]
+        columns.append(array)
+    return count, columns, width
+
+# Function to read the four combine columns of one sheet straight from the file without loading the
+# workbook, in the form read_combine_columns returns them for the loaded sheet: rows are as wide as
+# the widest row, and rows past the last one holding cells are left out
+def stream_combine_columns(file_path, sheet_name, spec):
+    wb = load_workbook(file_path, read_only=True)
+    try:
+        ws = wb[sheet_name]
+        # The stored dimensions are not relied on; the width is measured as the rows are read
+        ws.reset_dimensions()
+        rows = []
+        width = 0
+        last_row = 0
+        for row in ws.iter_rows(values_only=True):
+            rows.append(row)
+            if row:
+                width = max(width, len(row))
+                last_row = len(rows)
+    finally:
+        wb.close()
+    return columns_from_rows(rows[1:last_row], spec, width, convert=None)
+
+# Function to give every distinct value of an object array a code, equal values (as a dict key
+# would compare them) getting the same code
+def factorize(values):
+    codes = {}
+    return np.fromiter((codes.setdefault(value, len(codes)) for value in values), dtype=np.int64, count=len(values))
+
+# Function to raise the error of the first failing row, by reading that row the way a single row is read
+def raise_row_error(index, columns, width, spec, first_row):
+    row = [None] * width
+    for col, array in zip(spec['columns'], columns):
+        if array is not None:
+            row[col] = array[index]
+    try:
+        row_key_value(tuple(row), spec)
+    except Exception as e:
+        raise CombineRowError(first_row + index, e)
+
+# Function to group the data rows of a sheet, given as its four combine columns (read_combine_columns),
+# the first of them being sheet row first_row. Returns a plan: heads, the first row of every group with
+# more than one row, with joined, their combined values (groups in first-seen order), and dropped, the
+# other rows of those groups in sheet order.
+def group_columns(count, columns, width, spec, first_row=2):
+    name_values, num_values, group_values, values = columns
+    text = spec['key_style'] == "text"
+    empty = {'heads': [], 'joined': [], 'dropped': [], 'rows': count, 'groups': 0, 'width': width}
+    if count == 0:
+        return empty
+    if name_values is None or num_values is None or group_values is None:
+        raise_row_error(0, columns, width, spec, first_row)
+
+    if text:
+        names = lower(as_text(name_values))
+        nums = as_text(num_values)
+        groups = as_text(group_values)
+        failing = np.zeros(count, dtype=bool)
+    else:
+        # Only text class names can be lowercased
+        named = truth(name_values).astype(bool)
+        failing = named & ~is_text(name_values).astype(bool)
+        names = np.full(count, "", dtype=object)
+        names[named & ~failing] = lower(name_values[named & ~failing])
+        nums = num_values
+        groups = group_values
+
+    # Rows whose key cells are all empty are left alone; the others must have a value cell
+    keyed = truth(names).astype(bool) | truth(nums).astype(bool) | truth(groups).astype(bool)
+    if values is None:
+        failing |= keyed
+    if failing.any():
+        raise_row_error(int(np.argmax(failing)), columns, width, spec, first_row)
+    keyed = np.flatnonzero(keyed)
+    if len(keyed) == 0:
+        return empty
+
+    keys = np.stack([factorize(names[keyed]), factorize(nums[keyed]), factorize(groups[keyed])], axis=1)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    # Number the groups in the order their first rows appear
+    order = np.argsort(first, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    group_of = rank[inverse.reshape(-1)]
+    firsts = first[order]
+    sizes = np.bincount(group_of, minlength=len(order))
+
+    is_first = np.zeros(len(keyed), dtype=bool)
+    is_first[firsts] = True
+    combined = np.flatnonzero(sizes > 1)
+
+    # Each group's values in sheet order, the groups one after another
+    group_values = values[keyed]
+    if text:
+        group_values = as_text(group_values)
+    group_values = group_values[np.argsort(group_of, kind="stable")]
+    bounds = np.concatenate(([0], np.cumsum(sizes)))
+    joined = [', '.join(v for v in group_values[bounds[g]:bounds[g + 1]] if v) for g in combined]
+
+    return {
+        'heads': (keyed[firsts[combined]] + first_row).tolist(),
+        'joined': joined,
+        'dropped': (keyed[~is_first] + first_row).tolist(),
+        'rows': count,
+        'groups': len(order),
+        'width': width,
+    }
+
+# Function to delete many rows of a worksheet at once. Cells below a deleted row move up just as
+# with ws.delete_rows, but every cell is moved once rather than once per deleted row above it.
+def delete_rows_at_once(ws, rows):
+    deleted = sorted(set(rows))
+    if not deleted:
+        return
+    deleted_set = set(deleted)
+    cells = {}
+    for (row, column), cell in ws._cells.items():
+        if row in deleted_set:
+            continue
+        new_row = row - bisect_left(deleted, row)
+        cell.row = new_row
+        cells[(new_row, column)] = cell
+    ws._cells = cells
+    ws._current_row = ws.max_row
+
+# Function to apply a combine plan to the worksheet it was made from: write the joined values,
+# highlight each group's first row and remove the rest of the group in one pass. marking "fill"
+# fills the rows' cells, "conditional" adds one conditional formatting rule for all of them.
+def apply_combine(ws, spec, plan, fill=YELLOW_FILL, marking="fill"):
+    value_column = spec['columns'][3] + 1
+    # ws.max_column scans every cell, so the width is taken once rather than per group
+    width = ws.max_column
+    for first_row, combined_value in zip(plan['heads'], plan['joined']):
+        ws.cell(row=first_row, column=value_column).value = combined_value
+        if marking == "fill":
+            for col in range(1, width + 1):
+                ws.cell(row=first_row, column=col).fill = fill
+
+    delete_rows_at_once(ws, plan['dropped'])
+
+    if marking == "conditional" and plan['heads']:
+        deleted = plan['dropped']
+        columns = range(1, ws.max_column + 1)
+        add_highlight_rule(ws, [
+            (row_idx - bisect_left(deleted, row_idx), col)
+            for row_idx in plan['heads']
+            for col in columns
+        ], fill)
+
+# Function to combine a worksheet in place, below its header row. Returns the plan's counts:
+# rows scanned, groups found, groups combined and rows removed. progress, when given, is called
+# as progress("scanned", rows) and progress("groups", groups found) as the work goes on.
+def combine_sheet(ws, spec, fill=YELLOW_FILL, marking="fill", progress=None):
+    count, columns, width = read_combine_columns(ws, spec)
+    if progress is not None:
+        progress("scanned", count)
+    plan = group_columns(count, columns, width, spec)
+    if progress is not None:
+        progress("groups", plan['groups'])
+    apply_combine(ws, spec, plan, fill, marking)
+    return plan_counts(plan)
+
+# Function to get a plan's counts: rows scanned, groups found, groups combined and rows removed
+def plan_counts(plan):
+    return {'rows': plan['rows'], 'groups': plan['groups'], 'combined': len(plan['heads']),
+            'removed': len(plan['dropped'])}
+
+# Class to write a task's merged sheet already combined (see olemerge.make_task). The transformed rows
+# are held in memory, grouped when the merge is done and written once: header, then every row that
+# is kept, with the groups' joined values and highlights, as combine_sheet would leave the saved merge.
+class CombiningSheetWriter(MergeSheetWriter):
+    def __init__(self, merge_wb, task, plan, fill=YELLOW_FILL):
+        super().__init__(merge_wb, task, plan)
+        self.task_name = task['name']
+        self.spec = task['combine']
+        self.marking = task.get('combine_marking', "fill")
+        self.fill = fill
+        self.rows = []
+        # Why the rows could not be combined, if they could not; merge_folder then saves them as a plain merge
+        self.combine_error = None
+
+    def write_row(self, row):
+        self.rows.append(row)
+
+    def close(self):
+        plan = None
+        if self.rows:
+            try:
+                plan = group_columns(*columns_from_rows(self.rows, self.spec, self.width), self.spec)
+            except (CombineRowError, TypeError) as e:
+                self.combine_error = str(e)
+                print(f"Could not combine {self.task_name}, saving its rows uncombined: {str(e)}")
+        if plan is None:
+            plan = {'heads': [], 'joined': [], 'dropped': [], 'rows': len(self.rows), 'groups': 0, 'width': self.width}
+        self.write_combined(plan)
+        self.rows = []
+        if plan['heads']:
+            print(f"Combined {len(plan['heads'])} groups of {self.task_name}, folding {len(plan['dropped'])} rows")
+        return super().close()
+
+    def write_combined(self, plan):
+        dropped = plan['dropped']
+        for transform in self.transforms:
+            drop_rows = getattr(transform, 'drop_rows', None)
+            if drop_rows is not None and dropped:
+                drop_rows(self.ws, dropped)
+
+        heads = dict(zip(plan['heads'], plan['joined']))
+        dropped = set(dropped)
+        value_idx = self.spec['columns'][3]
+        for row_number, row in enumerate(self.rows, start=2):
+            if row_number in dropped:
+                continue
+            combined_value = heads.get(row_number)
+            if combined_value is not None:
+                if isinstance(row[value_idx], Cell):
+                    row[value_idx].value = combined_value
+                else:
+                    row[value_idx] = combined_value
+                if self.marking == "fill":
+                    row = [self.highlighted(value) for value in row]
+            self.ws.append(row)
+
+        if self.marking == "conditional" and heads:
+            deleted = plan['dropped']
+            add_highlight_rule(self.ws, [
+                (row_idx - bisect_left(deleted, row_idx), col)
+                for row_idx in plan['heads']
+                for col in range(1, self.width + 1)
+            ], self.fill)
+
+    def highlighted(self, value):
+        cell = WriteOnlyCell(self.ws, value=stored_value(value))
+        cell.fill = self.fill
+        return cell
+
+# Function to get the file a combined workbook is saved as: <name>_processed.xlsx next to it
+def processed_path(file_path):
+    return file_path.rsplit('.', 1)[0] + '_processed.xlsx'
+
+# Function to save a workbook to a temporary file next to output_path and rename it into place
+def save_workbook(wb, output_path):
+    temp_path = temporary_path(output_path)
+    try:
+        wb.save(temp_path)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+# Function to combine one sheet of a workbook file and save the workbook, by default as
+# processed_path(file_path). The workbook is written to a temporary file and renamed into place.
+# progress is passed to combine_sheet and also called as progress("written", rows) once saved.
+# Returns (output_path, counts).
+def combine_file(file_path, sheet_name, spec, output_path=None, fill=YELLOW_FILL, marking="fill", progress=None):
+    if output_path is None:
+        output_path = processed_path(file_path)
+    wb = load_workbook(file_path)
+    ws = wb[sheet_name]
+    counts = combine_sheet(ws, spec, fill, marking, progress)
+    save_workbook(wb, output_path)
+    if progress is not None:
+        progress("written", counts['rows'] - counts['removed'])
+    return output_path, counts
+
+# Function run in a combine worker process: combine_file, sending each progress (event, count) and
+# then ("done", output_path), ("row_error", row_idx, index_error, message) or ("error", message)
+def combine_worker(conn, file_path, sheet_name, spec, output_path, fill, marking):
+    try:
+        output_path, _ = combine_file(file_path, sheet_name, spec, output_path, fill, marking,
+                                      lambda event, count: conn.send((event, count)))
+        conn.send(("done", output_path))
+    except CombineRowError as e:
+        conn.send(("row_error", e.row_idx, isinstance(e.error, IndexError), str(e)))
+    except Exception as e:
+        conn.send(("error", str(e)))
+    finally:
+        conn.close()
+
+# Class to run combine_file in a process of its own, so a window stays responsive while it runs and
+# the combine can be cancelled at any point without leaving a half-written file. poll() returns the
+# worker's messages received so far (see combine_worker) and never blocks.
+class CombineJob:
+    def __init__(self, file_path, sheet_name, spec, output_path=None, fill=YELLOW_FILL, marking="fill"):
+        self.output_path = output_path or processed_path(file_path)
+        self.finished = False
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        self.conn = receiver
+        self.process = multiprocessing.Process(
+            target=combine_worker, args=(sender, file_path, sheet_name, spec, self.output_path, fill, marking),
+            daemon=True
+        )
+        self.process.start()
+        sender.close()
+
+    def poll(self):
+        messages = []
+        while not self.finished and self.conn.poll():
+            try:
+                message = self.conn.recv()
+            except EOFError:
+                self.process.join()
+                message = ("error", f"Worker exited with code {self.process.exitcode}")
+            messages.append(message)
+            if message[0] in ("done", "row_error", "error"):
+                self.close()
+        return messages
+
+    def cancel(self):
+        if self.finished:
+            return
+        self.process.kill()
+        self.close()
+        temp_path = temporary_path(self.output_path)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    def close(self):
+        self.finished = True
+        self.conn.close()
+        self.process.join()
+
+EXIT_OK = 0
+EXIT_FAILURES = 1
+EXIT_USAGE = 2
+
+# Function to expand workbooks, folders and glob patterns into the workbooks to combine, in order,
+# leaving out combined outputs and Excel lock files
+def find_combine_inputs(patterns):
+    paths = []
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(glob.glob(os.path.join(pattern, "*.xlsx")))
+        else:
+            matches = sorted(glob.glob(pattern))
+        for path in matches:
+            filename = os.path.basename(path)
+            if filename.endswith("_processed.xlsx") or filename.startswith("~$") or path in seen:
+                continue
+            seen.add(path)
+            paths.append(path)
+    return paths
+
+# Function to list the worksheets of a workbook whose names match any of the patterns (all of them without)
+def list_combine_sheets(file_path, sheets=None):
+    wb = load_workbook(file_path, read_only=True)
+    try:
+        names = [ws.title for ws in wb.worksheets]
+    finally:
+        wb.close()
+    if sheets:
+        names = [name for name in names if any(fnmatchcase(name, pattern) for pattern in sheets)]
+    return names
+
+# Function run in a batch worker: group one sheet from its streamed columns.
+# Returns (plan, error, seconds); errors come back as text so they cross the process boundary.
+def plan_sheet(file_path, sheet_name, spec):
+    start = time.perf_counter()
+    try:
+        plan = group_columns(*stream_combine_columns(file_path, sheet_name, spec), spec)
+        return plan, None, time.perf_counter() - start
+    except Exception as e:
+        return None, str(e), time.perf_counter() - start
+
+# Function run in a batch worker: load a workbook once, apply its sheets' plans and save it as output_path.
+# A plan is only applied when the loaded sheet has the size the streamed one had; otherwise (e.g. merged
+# cells past the last value), or with no plan at all, the loaded sheet is grouped here as combine_file does.
+# The workbook is not saved when no sheet could be combined. Returns ({sheet: counts}, {sheet: error}, seconds).
+def write_combined_file(file_path, sheet_plans, spec, output_path, fill=YELLOW_FILL, marking="fill"):
+    start = time.perf_counter()
+    wb = load_workbook(file_path)
+    counts = {}
+    errors = {}
+    for sheet_name, plan in sheet_plans:
+        ws = wb[sheet_name]
+        if plan is None or ws.max_column != plan['width'] or max(ws.max_row - 1, 0) != plan['rows']:
+            try:
+                plan = group_columns(*read_combine_columns(ws, spec), spec)
+            except Exception as e:
+                errors[sheet_name] = str(e)
+                continue
+        apply_combine(ws, spec, plan, fill, marking)
+        counts[sheet_name] = plan_counts(plan)
+    if counts:
+        save_workbook(wb, output_path)
+    return counts, errors, time.perf_counter() - start
+
+# Function to run a job in this process and hand back its result as a finished future
+def run_inline(func, *args):
+    future = Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+# Function to combine every sheet, or the sheets matching the name patterns in sheets, of many workbooks
+# with one spec, saving each as processed_path(file), or under the same name in output_folder. With a
+# pool of `workers` processes (None for one per CPU), the sheets of a multi-sheet workbook are grouped
+# concurrently and the workbook is then loaded once more to apply them; a single-sheet workbook, or
+# every workbook with workers=1 (run in this process), is loaded and combined in one pass instead,
+# as streaming it first would only read it twice. A sheet that cannot be combined is left as it was. Returns a report: 'run' totals, 'files' and 'sheets' records (see write_combine_report).
+def combine_files(file_paths, spec, sheets=None, workers=None, fill=YELLOW_FILL, marking="fill",
+                  output_folder=None):
+    started = time.perf_counter()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    files = {}
+    sheet_records = {}
+    sheet_order = {}
+    plans = {}
+    running = {}
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    # A pool broken by a dead worker refuses new jobs; they fail like any other job instead
+    def submit(func, *args):
+        if executor is None:
+            return run_inline(func, *args)
+        try:
+            return executor.submit(func, *args)
+        except Exception as e:
+            future = Future()
+            future.set_exception(e)
+            return future
+
+    try:
+        for file_path in file_paths:
+            output_path = processed_path(file_path)
+            if output_folder:
+                output_path = os.path.join(output_folder, os.path.basename(output_path))
+            record = {'file': file_path, 'output': output_path, 'sheets': 0, 'write': None, 'error': None}
+            files[file_path] = record
+            try:
+                names = list_combine_sheets(file_path, sheets)
+            except Exception as e:
+                record['error'] = str(e)
+                continue
+            if not names:
+                record['error'] = "No sheets to combine"
+                continue
+            record['sheets'] = len(names)
+            sheet_order[file_path] = names
+            plans[file_path] = {}
+            for sheet_name in names:
+                sheet_records[(file_path, sheet_name)] = {
+                    'file': os.path.basename(file_path), 'sheet': sheet_name, 'rows': None, 'groups': None,
+                    'combined': None, 'removed': None, 'plan': None, 'error': None,
+                }
+            if executor is None or len(names) == 1:
+                running[submit(write_combined_file, file_path, [(name, None) for name in names], spec,
+                               output_path, fill, marking)] = (file_path, None)
+                continue
+            for sheet_name in names:
+                running[submit(plan_sheet, file_path, sheet_name, spec)] = (file_path, sheet_name)
+
+        # A workbook is written as soon as the last of its sheets is grouped
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_path, sheet_name = running.pop(future)
+                record = files[file_path]
+                if sheet_name is not None:
+                    try:
+                        plan, error, seconds = future.result()
+                    except Exception as e:
+                        # e.g. BrokenProcessPool when a worker died, taking the pool with it
+                        plan, error, seconds = None, str(e) or type(e).__name__, None
+                    sheet_record = sheet_records[(file_path, sheet_name)]
+                    sheet_record['plan'] = seconds
+                    if error is not None:
+                        sheet_record['error'] = error
+                        print(f"Could not combine {os.path.basename(file_path)} sheet {sheet_name}: {error}")
+                    plans[file_path][sheet_name] = plan
+                    if len(plans[file_path]) == record['sheets']:
+                        # Plans go back in the workbook's sheet order
+                        planned = [(name, plans[file_path][name]) for name in sheet_order[file_path]
+                                   if plans[file_path][name] is not None]
+                        if not planned:
+                            record['error'] = "No sheet could be combined"
+                            record['output'] = None
+                            continue
+                        running[submit(write_combined_file, file_path, planned, spec, record['output'],
+                                       fill, marking)] = (file_path, None)
+                    continue
+
+                try:
+                    counts, errors, seconds = future.result()
+                except Exception as e:
+                    record['error'] = str(e) or type(e).__name__
+                    record['output'] = None
+                    print(f"Error combining {os.path.basename(file_path)}: {record['error']}")
+                    continue
+                record['write'] = seconds
+                for name, sheet_counts in counts.items():
+                    sheet_records[(file_path, name)].update(sheet_counts)
+                for name, error in errors.items():
+                    sheet_records[(file_path, name)]['error'] = error
+                    print(f"Could not combine {os.path.basename(file_path)} sheet {name}: {error}")
+                if not counts:
+                    record['error'] = "No sheet could be combined"
+                    record['output'] = None
+                    continue
+                removed = sum(sheet_counts['removed'] for sheet_counts in counts.values())
+                print(f"Combined {os.path.basename(file_path)}: {len(counts)} sheets, {removed} rows folded, "
+                      f"saved to {record['output']}")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    file_records = list(files.values())
+    sheet_list = list(sheet_records.values())
+    return {
+        'run': {
+            'elapsed': time.perf_counter() - started,
+            'workers': workers,
+            'files': len(file_records),
+            'failed_files': sum(1 for record in file_records if record['error']),
+            'sheets': len(sheet_list),
+            'failed_sheets': sum(1 for record in sheet_list if record['error']),
+            'rows': sum(record['rows'] or 0 for record in sheet_list),
+            'removed': sum(record['removed'] or 0 for record in sheet_list),
+        },
+        'files': file_records,
+        'sheets': sheet_list,
+    }
+
+# Function to write a combine_files report as <prefix>.json (everything) and <prefix>.csv (one row per sheet)
+def write_combine_report(report, prefix):
+    with open(f"{prefix}.json", "w") as f:
+        json.dump(report, f, indent=2)
+    fields = ['file', 'sheet', 'rows', 'groups', 'combined', 'removed', 'plan', 'error']
+    with open(f"{prefix}.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for record in report['sheets']:
+            writer.writerow(record)
+
+# Function to parse --columns: four column letters, or with --text-keys also 1-based numbers
+def spec_from_argument(columns, key_style):
+    parts = [part.strip() for part in columns.split(',')]
+    if len(parts) != 4 or not all(part.isalpha() or part.isdigit() for part in parts):
+        raise ValueError(f"expected four columns such as A,B,C,D, got {columns!r}")
+    if all(part.isdigit() for part in parts):
+        return make_combine_spec([int(part) - 1 for part in parts], key_style)
+    return combine_spec_from_letters(parts, key_style)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Combine award rows in many workbooks with one set of columns")
+    parser.add_argument("inputs", nargs="+", help="workbooks, folders or glob patterns such as 'D:/Merges/*.xlsx'")
+    parser.add_argument("--columns", required=True,
+                        help="class name, class number, grouping criteria and values columns, e.g. A,B,C,D or 1,2,3,4")
+    parser.add_argument("--text-keys", action="store_true",
+                        help="compare the key cells as stripped text, as combineawards.py does")
+    parser.add_argument("--sheet", action="append", help="sheet name or pattern to combine, repeatable (default every sheet)")
+    parser.add_argument("--workers", type=int, help="worker processes, 0 for one per CPU (the default), 1 to run in this process")
+    parser.add_argument("--highlight", choices=["fill", "conditional"], default="fill",
+                        help="highlight combined rows with a fill per cell or one conditional format per sheet")
+    parser.add_argument("--output-dir", help="save the _processed.xlsx files here instead of next to each workbook")
+    parser.add_argument("--report", default="combine_report",
+                        help="write the summary to REPORT.json and REPORT.csv (default combine_report)")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        spec = spec_from_argument(args.columns, "text" if args.text_keys else "raw")
+    except ValueError as e:
+        print(f"Invalid columns: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    file_paths = find_combine_inputs(args.inputs)
+    if not file_paths:
+        print("No workbooks found", file=sys.stderr)
+        return EXIT_USAGE
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    report = combine_files(file_paths, spec, args.sheet, args.workers or None, marking=args.highlight,
+                           output_folder=args.output_dir)
+    write_combine_report(report, args.report)
+
+    run = report['run']
+    for record in report['files']:
+        if record['error']:
+            print(f"Failed: {record['file']}: {record['error']}", file=sys.stderr)
+    print(f"{run['files']} files, {run['sheets']} sheets, {run['rows']} rows, {run['removed']} folded, "
+          f"{run['failed_files']} files and {run['failed_sheets']} sheets failed, {run['elapsed']:.1f}s")
+    return EXIT_FAILURES if run['failed_files'] or run['failed_sheets'] else EXIT_OK
+
+if __name__ == "__main__":
+    sys.exit(main())
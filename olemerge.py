@@ -0,0 +1,1052 @@
+import gc
+import io
+import multiprocessing
+import os
+import time
+import zipfile
+from bisect import bisect_left
+from collections import deque
+from fnmatch import fnmatchcase
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.connection import wait as wait_connections
+from openpyxl import load_workbook, Workbook
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.styles import PatternFill
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.formatting.rule import FormulaRule
+from olecache import ExtractionCache, CheckpointJournal, file_sha256
+import xlsxrange
+from olemetrics import current_rss_bytes, reset_peak_rss, peak_rss_since_reset
+from oleprefetch import Prefetcher, MappedFile, DEFAULT_PREFETCH_BYTES
+
+# Sheets that hold class setup rather than student records (fnmatch patterns)
+EXCLUDED_SHEETS = ["index", "list", "setting", "TEMPLATE", "STUDENTINFO"]
+
+# Probe that only lets through student sheets ticked in M4 (ole2425, ole3)
+M4_TICK_PROBE = ("M4", "equals", "✔")
+
+# Function to parse range strings
+def parse_range(range_str):
+    start, end = range_str.upper().split(':')
+    def split_col_row(cell):
+        col = ''.join(filter(str.isalpha, cell))
+        row = ''.join(filter(str.isdigit, cell))
+        return col, int(row)
+    start_col, start_row = split_col_row(start)
+    end_col, end_row = split_col_row(end)
+    return start_col, start_row, end_col, end_row
+
+# Fill used to mark cells whose zero value was blanked
+PINK_FILL = PatternFill(start_color='FFC0CB', end_color='FFC0CB', fill_type='solid')
+
+# Row transforms: each takes the output row (a list, sheet name already in column S)
+# and the output sheet, and returns the row. A task applies its chain once per row.
+
+# Transform to concatenate a column with the sheet name in column S, e.g. P -> "P-S"
+def concat_sheet_name(letter):
+    idx = column_index_from_string(letter.upper()) - 1
+    def transform(row, ws):
+        if row[idx] and row[18]:
+            row[idx] = f"{row[idx]}-{row[18]}"
+        return row
+    return transform
+
+# Ways of marking blanked zeros: a fill on each cell, or one conditional formatting rule per sheet
+ZERO_MARKINGS = ("fill", "conditional")
+
+# Function to highlight cells with one conditional formatting rule instead of a fill per cell.
+# cells are (row, column) pairs; neighbouring cells of a row are joined into one range.
+def add_highlight_rule(ws, cells, fill):
+    ranges = []
+    run = None
+    for row, column in sorted(set(cells)):
+        if run and run[0] == row and run[2] == column - 1:
+            run[2] = column
+            continue
+        if run:
+            ranges.append(run)
+        run = [row, column, column]
+    if run:
+        ranges.append(run)
+    if not ranges:
+        return
+
+    refs = [
+        f"{get_column_letter(first)}{row}" if first == last
+        else f"{get_column_letter(first)}{row}:{get_column_letter(last)}{row}"
+        for row, first, last in ranges
+    ]
+    ws.conditional_formatting.add(" ".join(refs), FormulaRule(formula=["TRUE"], fill=fill))
+
+# Class to blank zeros like blank_zeros, but mark them with one conditional formatting rule added
+# when the sheet is finished, so the blanked cells carry no style and are not written at all. Transforms run once per
+# data row below the single header row, which is how the row numbers are counted per sheet.
+class ConditionalZeroMarks:
+    def __init__(self, fill=PINK_FILL):
+        self.fill = fill
+        self.rows = {}
+        self.cells = {}
+
+    def __call__(self, row, ws):
+        row_number = self.rows.get(ws, 1) + 1
+        self.rows[ws] = row_number
+        for idx, value in enumerate(row):
+            if value == 0 or value == 0.0:
+                # The rule's range names the cell, so it need not be written at all
+                row[idx] = None
+                self.cells.setdefault(ws, []).append((row_number, idx + 1))
+        return row
+
+    # Called when marked rows (sorted row numbers) are left out of the sheet: their marks go
+    # and the marks below them move up
+    def drop_rows(self, ws, rows):
+        dropped = set(rows)
+        self.cells[ws] = [
+            (row - bisect_left(rows, row), column)
+            for row, column in self.cells.get(ws, []) if row not in dropped
+        ]
+
+    # Called by MergeSheetWriter.close() before the workbook is saved
+    def finish(self, ws):
+        self.rows.pop(ws, None)
+        add_highlight_rule(ws, self.cells.pop(ws, []), self.fill)
+
+# Transform to blank zero values and mark them with a fill, or with marking="conditional"
+# one conditional formatting rule over all of them (see ConditionalZeroMarks)
+def blank_zeros(fill=PINK_FILL, marking="fill"):
+    if marking not in ZERO_MARKINGS:
+        raise ValueError(f"Unknown zero marking: {marking}")
+    if marking == "conditional":
+        return ConditionalZeroMarks(fill)
+
+    def transform(row, ws):
+        for idx, value in enumerate(row):
+            if value == 0 or value == 0.0:
+                cell = WriteOnlyCell(ws, value="")
+                cell.fill = fill
+                row[idx] = cell
+        return row
+    return transform
+
+# Function to build a task spec. Without explicit transforms, each of concat_columns
+# is joined with the sheet name in column S and zeros are blanked in pink (zero_marking
+# picks how the pink is applied, see blank_zeros).
+# row_selection names one of ROW_SELECTORS and decides which rows of a sheet are copied.
+# Sheets matching excluded_sheets, or failing any probe (cell, "equals" | "non_empty", value),
+# are skipped before their data is parsed, as are unchanged copies of a sheet matching template_sheets.
+# combine, a spec from olecombine.make_combine_spec, folds the merged rows into groups as they are
+# written, highlighted the zero_marking way, and the task is saved as merge_<name>_processed.xlsx.
+def make_task(name, process_range, criteria_range, concat_columns=("P",), transforms=None,
+              row_selection="criteria", excluded_sheets=EXCLUDED_SHEETS, probes=(), zero_marking="fill",
+              template_sheets=(), combine=None):
+    if transforms is None:
+        transforms = [concat_sheet_name(letter) for letter in concat_columns] + [blank_zeros(marking=zero_marking)]
+    return {
+        'name': name,
+        'process_range': process_range,
+        'criteria_range': criteria_range,
+        'transforms': list(transforms),
+        'row_selection': row_selection,
+        'excluded_sheets': list(excluded_sheets),
+        'probes': list(probes),
+        'template_sheets': list(template_sheets),
+        'combine': combine,
+        'combine_marking': zero_marking,
+    }
+
+# Function to build the default tasks of the nightly merge; options go to make_task
+def default_tasks(**options):
+    return [
+        make_task("OLE", "cv26:dm205", "cv26:cv205", **options),
+        make_task("Displine", "bb26:bj205", "bb26:bb205", concat_columns=("P", "I"), **options),
+    ]
+
+DEFAULT_TASKS = default_tasks()
+
+# Function to resolve a task's ranges into numeric bounds once, before any file is opened.
+# Without a criteria range, the first column of the process range is used.
+def build_plan(task_name, process_range, criteria_range, row_selection="criteria",
+               excluded_sheets=EXCLUDED_SHEETS, probes=(), template_sheets=()):
+    proc_start_col, proc_start_row, proc_end_col, proc_end_row = parse_range(process_range)
+    if criteria_range:
+        crit_start_col, crit_start_row, crit_end_col, crit_end_row = parse_range(criteria_range)
+    else:
+        crit_start_col, crit_start_row, crit_end_row = proc_start_col, proc_start_row, proc_end_row
+
+    proc_min_col = column_index_from_string(proc_start_col)
+    proc_max_col = column_index_from_string(proc_end_col)
+    crit_col = column_index_from_string(crit_start_col)
+
+    resolved_probes = []
+    for ref, op, expected in probes:
+        probe_col = ''.join(filter(str.isalpha, ref.upper()))
+        probe_row = int(''.join(filter(str.isdigit, ref)))
+        resolved_probes.append(((probe_row, column_index_from_string(probe_col)), op, expected))
+
+    return {
+        'name': task_name,
+        'row_selection': row_selection,
+        'excluded_sheets': tuple(excluded_sheets),
+        'probes': tuple(resolved_probes),
+        'template_sheets': tuple(template_sheets),
+        'proc_min_row': proc_start_row,
+        'proc_max_row': proc_end_row,
+        'proc_min_col': proc_min_col,
+        'proc_max_col': proc_max_col,
+        'crit_col': crit_col,
+        'crit_min_row': crit_start_row,
+        'crit_max_row': crit_end_row,
+        # Rows past the last criteria row are still copied if the criteria range runs longer
+        'min_row': min(proc_start_row, crit_start_row),
+        'max_row': max(proc_end_row, crit_end_row),
+        'min_col': min(proc_min_col, crit_col),
+        'max_col': max(proc_max_col, crit_col),
+    }
+
+# Function to build the plans of a list of task specs
+def build_plans(tasks):
+    return [
+        build_plan(task['name'], task['process_range'], task['criteria_range'], task['row_selection'],
+                   task['excluded_sheets'], task['probes'], task.get('template_sheets', ()))
+        for task in tasks
+    ]
+
+# Function to drop byte-identical copies of a workbook. Of each set of copies the one with the
+# shortest name is kept, so "3A.xlsx" wins over "Copy of 3A.xlsx" and "3A (1).xlsx".
+# Only files that share their size with another are hashed. Returns (kept paths, [(copy, original)]).
+def drop_duplicate_files(file_paths):
+    by_size = {}
+    for file_path in file_paths:
+        by_size.setdefault(os.path.getsize(file_path), []).append(file_path)
+
+    originals = {}
+    for same_size in by_size.values():
+        if len(same_size) < 2:
+            continue
+        by_hash = {}
+        for file_path in same_size:
+            by_hash.setdefault(file_sha256(file_path), []).append(file_path)
+        for copies in by_hash.values():
+            original = min(copies, key=lambda path: len(os.path.basename(path)))
+            for file_path in copies:
+                if file_path != original:
+                    originals[file_path] = original
+
+    kept = [path for path in file_paths if path not in originals]
+    return kept, [(path, originals[path]) for path in file_paths if path in originals]
+
+# Function to list the source workbooks of a folder in a stable order, leaving out the file names
+# in excluded (see merge_filenames)
+def list_source_files(target_folder, excluded=()):
+    return [
+        os.path.join(target_folder, filename)
+        for filename in sorted(os.listdir(target_folder))
+        if filename.endswith('.xlsx') and not filename.startswith('~$') and filename not in excluded
+    ]
+
+# Function to read a rectangular block of values, padded so every row has the full width
+def read_block(ws, min_row, max_row, min_col, max_col):
+    width = max_col - min_col + 1
+    block = []
+    for values in ws.iter_rows(min_row=min_row, max_row=max_row,
+                               min_col=min_col, max_col=max_col, values_only=True):
+        if len(values) < width:
+            values = tuple(values) + (None,) * (width - len(values))
+        block.append(values)
+    # Read-only sheets stop at their last stored row
+    while len(block) < max_row - min_row + 1:
+        block.append((None,) * width)
+    return block
+
+# Function to turn a block into a boolean mask of its non-empty cells (not None and not "")
+def occupancy_mask(block):
+    cells = np.array(block, dtype=object)
+    return (cells != None) & (cells != "")
+
+# Function to take the non-blank process rows of a block from first_row to last_row
+def non_blank_rows(plan, block, mask, origin_row, origin_col, last_row):
+    first_col = plan['proc_min_col'] - origin_col
+    last_col = plan['proc_max_col'] - origin_col + 1
+    start = plan['proc_min_row'] - origin_row
+    stop = last_row - origin_row + 1
+    keep = np.flatnonzero(mask[start:stop, first_col:last_col].any(axis=1)) + start
+    return [block[idx][first_col:last_col] for idx in keep.tolist()]
+
+# Row selection: copy non-blank rows up to the last filled cell of the criteria column (OLE-final).
+# Returns None when the criteria column is empty, so the sheet is not counted.
+def select_by_criteria(plan, block, mask, origin_row, origin_col):
+    criteria = mask[plan['crit_min_row'] - origin_row:plan['crit_max_row'] - origin_row + 1,
+                    plan['crit_col'] - origin_col]
+    filled = np.flatnonzero(criteria)
+    if not filled.size:
+        return None
+    last_row = plan['crit_min_row'] + int(filled[-1])
+    return non_blank_rows(plan, block, mask, origin_row, origin_col, last_row)
+
+# Row selection: copy non-blank rows up to the last row whose cells are all filled (ole4).
+# When no row is completely filled, the whole process range is used.
+def select_through_last_filled(plan, block, mask, origin_row, origin_col):
+    start = plan['proc_min_row'] - origin_row
+    process = mask[start:plan['proc_max_row'] - origin_row + 1,
+                   plan['proc_min_col'] - origin_col:plan['proc_max_col'] - origin_col + 1]
+    filled = np.flatnonzero(process.all(axis=1))
+    last_row = plan['proc_min_row'] + int(filled[-1]) if filled.size else plan['proc_max_row']
+    return non_blank_rows(plan, block, mask, origin_row, origin_col, last_row)
+
+# Row selection: copy every non-blank row of the process range (ole2425, ole3)
+def select_non_blank(plan, block, mask, origin_row, origin_col):
+    return non_blank_rows(plan, block, mask, origin_row, origin_col, plan['proc_max_row'])
+
+# Row selection strategies by name; plans carry the name so they stay picklable for worker processes
+ROW_SELECTORS = {
+    'criteria': select_by_criteria,
+    'all_filled': select_through_last_filled,
+    'non_blank': select_non_blank,
+}
+
+# Class to decide which sheets are parsed, and for which tasks, from the sheet name and a few probe cells.
+# sheet_names, when given, limits the gate to those sheets (one worker's share of a split workbook).
+# template_copies maps sheets found to be unchanged copies to their template (see find_template_copies).
+class SheetGate:
+    def __init__(self, plans, sheet_names=None, template_copies=None):
+        self.plans = plans
+        self.sheet_names = sheet_names
+        self.template_copies = template_copies or {}
+
+    # Plans whose exclusion patterns let the sheet name through
+    def plans_for(self, sheet_name):
+        if self.sheet_names is not None and sheet_name not in self.sheet_names:
+            return []
+        template = self.template_copies.get(sheet_name)
+        return [
+            plan for plan in self.plans
+            if not any(fnmatchcase(sheet_name, pattern) for pattern in plan['excluded_sheets'])
+            and not (template and any(fnmatchcase(template, pattern) for pattern in plan['template_sheets']))
+        ]
+
+    # Cells (row, column) that must be read before the sheet's block
+    def probe_cells(self, sheet_name):
+        return sorted({cell for plan in self.plans_for(sheet_name) for cell, _, _ in plan['probes']})
+
+    # Plans that still want the sheet once its probe cells are known
+    def admitted_plans(self, sheet_name, probe_values):
+        admitted = []
+        for plan in self.plans_for(sheet_name):
+            for cell, op, expected in plan['probes']:
+                value = probe_values.get(cell)
+                if op == "equals" and value != expected:
+                    break
+                if op == "non_empty" and value in (None, ""):
+                    break
+            else:
+                admitted.append(plan)
+        return admitted
+
+# Function to find sheets whose XML part is byte-identical to a sheet matching template_patterns,
+# returning {sheet_name: template_name}. Candidates are picked by the CRC and size the zip directory
+# already records, so only sheets that look identical are decompressed and compared.
+def find_template_copies(file_path, template_patterns):
+    copies = {}
+    with zipfile.ZipFile(file_path) as archive:
+        sheets = xlsxrange.read_workbook_info(archive)[0]
+        parts = {sheet_name: part for sheet_name, part, _ in sheets}
+        signatures = {}
+        for sheet_name, part in parts.items():
+            info = archive.getinfo(part)
+            signatures[sheet_name] = (info.CRC, info.file_size)
+
+        for template in parts:
+            if not any(fnmatchcase(template, pattern) for pattern in template_patterns):
+                continue
+            template_data = None
+            for sheet_name, part in parts.items():
+                if sheet_name == template or sheet_name in copies:
+                    continue
+                if signatures[sheet_name] != signatures[template]:
+                    continue
+                if template_data is None:
+                    template_data = archive.read(parts[template])
+                if archive.read(part) == template_data:
+                    copies[sheet_name] = template
+    return copies
+
+# Function to read the same block from every sheet the gate admits, returning [(sheet_name, block, plans)].
+# reader "xml" streams the sheet XML directly; "openpyxl" goes through a read-only workbook.
+# When a stats dict is given, the open time and each sheet's parse time are recorded in it.
+def read_sheet_blocks(file_path, min_row, max_row, min_col, max_col, gate, reader="openpyxl", stats=None):
+    if reader == "xml":
+        return xlsxrange.read_sheet_blocks(file_path, min_row, max_row, min_col, max_col, gate, stats)
+
+    if stats is None:
+        stats = {}
+    stats.setdefault('sheets', {})
+    blocks = []
+    start = time.perf_counter()
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    stats['open'] = time.perf_counter() - start
+    try:
+        for sheet_name in wb.sheetnames:
+            if not gate.plans_for(sheet_name):
+                continue
+            start = time.perf_counter()
+            ws = wb[sheet_name]
+            # Read-only cell lookups stop parsing at the probe's row
+            probe_values = {
+                (row, column): ws.cell(row=row, column=column).value
+                for row, column in gate.probe_cells(sheet_name)
+            }
+            plans = gate.admitted_plans(sheet_name, probe_values)
+            if plans:
+                blocks.append((sheet_name, read_block(ws, min_row, max_row, min_col, max_col), plans))
+            stats['sheets'][sheet_name] = {'parse': time.perf_counter() - start}
+    finally:
+        wb.close()
+    return blocks
+
+# Function to extract one workbook for every task, opening it and each of its sheets once.
+# file_path may also be a file object, such as a prefetched workbook in a BytesIO.
+# A stats dict, when given, receives the open time and per-sheet parse/select times.
+# sheet_names, when given, restricts the extraction to those sheets.
+def extract_workbook(file_path, plans, reader="openpyxl", stats=None, sheet_names=None):
+    if stats is None:
+        stats = {}
+    results = {plan['name']: [] for plan in plans}
+
+    # All tasks are served from one block covering the union of their ranges
+    min_row = min(plan['min_row'] for plan in plans)
+    max_row = max(plan['max_row'] for plan in plans)
+    min_col = min(plan['min_col'] for plan in plans)
+    max_col = max(plan['max_col'] for plan in plans)
+
+    template_patterns = {pattern for plan in plans for pattern in plan['template_sheets']}
+    template_copies = find_template_copies(file_path, template_patterns) if template_patterns else {}
+    # Only sheets that would otherwise be read count as skipped
+    name_gate = SheetGate(plans, sheet_names)
+    template_copies = {name: template for name, template in template_copies.items() if name_gate.plans_for(name)}
+    stats['template_copies'] = template_copies
+
+    gate = SheetGate(plans, sheet_names, template_copies)
+    blocks = read_sheet_blocks(file_path, min_row, max_row, min_col, max_col, gate, reader, stats)
+    for sheet_name, block, sheet_plans in blocks:
+        start = time.perf_counter()
+        # One occupancy mask per sheet serves every task's row selection
+        mask = occupancy_mask(block)
+        for plan in sheet_plans:
+            rows = ROW_SELECTORS[plan['row_selection']](plan, block, mask, min_row, min_col)
+            if rows is not None:
+                results[plan['name']].append((sheet_name, rows))
+        stats['sheets'][sheet_name]['select'] = time.perf_counter() - start
+    return results
+
+# Function to extract one workbook and measure it, returning (results, stats).
+# data, when given, is the workbook's bytes already read by the prefetcher. With sheet_names only
+# those sheets are read, from a memory map of the file shared with the workers reading the rest.
+# peak_rss is the peak RSS of the process reading it while it was read, where the peak can be reset
+# (Linux), otherwise the process's RSS once it is read; rss_growth is how far that is above the RSS
+# the process had before, i.e. the memory this workbook added.
+def extract_workbook_with_stats(file_path, plans, reader="openpyxl", data=None, sheet_names=None):
+    peak_reset = reset_peak_rss()
+    rss_before = current_rss_bytes()
+    if sheet_names is not None:
+        source = MappedFile(file_path)
+        stats = {'bytes_read': 0}
+    elif data is None:
+        source = file_path
+        stats = {'bytes_read': os.path.getsize(file_path)}
+    else:
+        source = io.BytesIO(data)
+        stats = {'bytes_read': len(data), 'prefetched': True}
+    start = time.perf_counter()
+    try:
+        results = extract_workbook(source, plans, reader, stats, sheet_names)
+    finally:
+        if sheet_names is not None:
+            source.close()
+    stats['extract'] = time.perf_counter() - start - stats['open']
+    stats['peak_rss'] = peak_rss_since_reset() if peak_reset else current_rss_bytes()
+    if stats['peak_rss'] is not None and rss_before is not None:
+        stats['rss_growth'] = max(stats['peak_rss'] - rss_before, 0)
+    stats['pid'] = os.getpid()
+    return results, stats
+
+# Function to pair each file with its bytes, read ahead when prefetch (files read ahead) is set.
+# Yields (file_path, data, read_error); data is None when the file is to be opened by path.
+def iter_sources(file_paths, prefetch=0, prefetch_bytes=DEFAULT_PREFETCH_BYTES):
+    if prefetch:
+        yield from Prefetcher(file_paths, prefetch, prefetch_bytes)
+    else:
+        for file_path in file_paths:
+            yield file_path, None, None
+
+# Workbooks at least this large have their sheets split across pool workers
+SPLIT_WORKBOOK_BYTES = 8 * 1024 * 1024
+
+# Function to split a workbook's sheets into up to `parts` runs of consecutive sheets with about
+# the same amount of sheet XML each. Returns [tuple of sheet names], or [] if it is not worth it.
+def split_sheets(file_path, plans, parts):
+    gate = SheetGate(plans)
+    with zipfile.ZipFile(file_path) as archive:
+        sheets = xlsxrange.read_workbook_info(archive)[0]
+        sizes = [
+            (sheet_name, archive.getinfo(part).file_size)
+            for sheet_name, part, _ in sheets if gate.plans_for(sheet_name)
+        ]
+    parts = min(parts, len(sizes))
+    if parts < 2:
+        return []
+
+    target = sum(size for _, size in sizes) / parts
+    chunks = [[]]
+    filled = 0
+    for idx, (sheet_name, size) in enumerate(sizes):
+        # Start the next chunk once this one has its share, keeping a sheet for every chunk left
+        if chunks[-1] and filled >= target and len(chunks) < parts:
+            chunks.append([])
+            filled = 0
+        elif chunks[-1] and len(sizes) - idx <= parts - len(chunks):
+            chunks.append([])
+            filled = 0
+        chunks[-1].append(sheet_name)
+        filled += size
+    return [tuple(chunk) for chunk in chunks]
+
+# Function to submit one workbook to the pool, returning its futures. A workbook of split_bytes
+# or more is split by sheet across up to `workers` futures; each worker parses its own sheets.
+def submit_workbook(executor, file_path, plans, reader, data=None, workers=1, split_bytes=SPLIT_WORKBOOK_BYTES):
+    chunks = []
+    if workers > 1 and split_bytes and os.path.getsize(file_path) >= split_bytes:
+        chunks = split_sheets(file_path, plans, workers)
+    if not chunks:
+        return [executor.submit(extract_workbook_with_stats, file_path, plans, reader, data)]
+    return [
+        executor.submit(extract_workbook_with_stats, file_path, plans, reader, None, chunk)
+        for chunk in chunks
+    ]
+
+# Function to wait for a workbook's futures and join them back in sheet order, returning (results, stats)
+def gather_workbook(file_path, plans, futures):
+    parts = [future.result() for future in futures]
+    if len(parts) == 1:
+        return parts[0]
+
+    results = {plan['name']: [] for plan in plans}
+    stats = {
+        'bytes_read': os.path.getsize(file_path),
+        'open': sum(part_stats['open'] for _, part_stats in parts),
+        'extract': sum(part_stats['extract'] for _, part_stats in parts),
+        'sheets': {},
+        'template_copies': {},
+        'peak_rss': max((part_stats['peak_rss'] or 0) for _, part_stats in parts),
+        # The parts run side by side in their own processes, so what they add together is the sum
+        'rss_growth': sum(part_stats.get('rss_growth') or 0 for _, part_stats in parts),
+        'pid': parts[0][1]['pid'],
+        'worker_pids': [part_stats['pid'] for _, part_stats in parts],
+        'split': len(parts),
+    }
+    # Each part covers a run of consecutive sheets, so joining in part order keeps the workbook order
+    for part_results, part_stats in parts:
+        for plan in plans:
+            results[plan['name']].extend(part_results[plan['name']])
+        stats['sheets'].update(part_stats['sheets'])
+        stats['template_copies'].update(part_stats['template_copies'])
+    return results, stats
+
+# Function to build the isolation settings of a run: each workbook is extracted in a process of
+# its own, killed after timeout seconds or when its resident memory grows by more than memory_cap
+# bytes over what it started with. A workbook that fails is tried once more with retry_reader, when given.
+def make_isolation(timeout=None, memory_cap=None, retry_reader=None):
+    return {'timeout': timeout, 'memory_cap': memory_cap, 'retry_reader': retry_reader}
+
+# How often the parent checks its isolated workers' memory under a memory cap
+MEMORY_POLL_SECONDS = 0.25
+
+# Function to tell whether a memory cap can be enforced here, i.e. whether the workers' resident
+# memory can be read (from /proc on Linux, otherwise through psutil)
+def memory_cap_supported():
+    return current_rss_bytes() is not None
+
+# Function to describe a worker stopped at the memory cap
+def memory_cap_message(memory_cap):
+    return f"Needed more than the {memory_cap // (1024 * 1024)} MB memory cap"
+
+# Error of a workbook whose isolated worker timed out, ran out of memory, crashed or raised.
+# kind is "timeout", "memory", "crash" or "error".
+class WorkbookFailure(Exception):
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+# Function run in an isolated worker: report the resident memory it starts with, which a forked
+# worker shares with the parent and which the memory cap comes on top of, then extract one
+# workbook and send back ("ok", (results, stats)) or (kind, message)
+def isolated_extract(conn, file_path, plans, reader, memory_cap):
+    try:
+        conn.send(("started", current_rss_bytes()))
+        conn.send(("ok", extract_workbook_with_stats(file_path, plans, reader)))
+    except MemoryError:
+        conn.send(("memory", memory_cap_message(memory_cap)))
+    except Exception as e:
+        conn.send(("error", str(e)))
+    finally:
+        conn.close()
+
+# Function to extract workbooks with each one in its own process (see make_isolation), at most
+# `workers` at a time. The caller gets the results in the given order; a failed workbook comes
+# back with a WorkbookFailure and stats recording the failure and whether it was retried.
+def extract_files_isolated(file_paths, plans, workers, reader, isolation):
+    timeout = isolation.get('timeout')
+    retry_reader = isolation.get('retry_reader')
+    memory_cap = isolation.get('memory_cap')
+    jobs = deque((path, reader, False) for path in file_paths)
+    running = {}
+    # Resident memory each worker reported at start; a worker is killed once it grows more than memory_cap past it
+    baselines = {}
+    outcomes = {}
+    order = deque(file_paths)
+
+    def finish(conn, outcome):
+        path, job_reader, retried, process, _ = running.pop(conn)
+        baselines.pop(conn, None)
+        conn.close()
+        process.join()
+        if outcome[0] == "ok":
+            outcomes[path] = outcome
+            return
+        kind, message = outcome
+        if retry_reader and not retried and retry_reader != job_reader:
+            print(f"Retrying {os.path.basename(path)} with the {retry_reader} reader after: {message}")
+            jobs.appendleft((path, retry_reader, True))
+            return
+        outcomes[path] = (kind, message, job_reader, retried)
+
+    while order:
+        while jobs and len(running) < workers:
+            path, job_reader, retried = jobs.popleft()
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=isolated_extract, args=(sender, path, plans, job_reader, memory_cap),
+                daemon=True
+            )
+            process.start()
+            sender.close()
+            running[receiver] = (path, job_reader, retried, process, time.monotonic())
+
+        if running:
+            deadlines = [started + timeout for *_, started in running.values()] if timeout else []
+            wait_for = max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+            if memory_cap:
+                wait_for = MEMORY_POLL_SECONDS if wait_for is None else min(wait_for, MEMORY_POLL_SECONDS)
+            for conn in wait_connections(list(running), wait_for):
+                try:
+                    outcome = conn.recv()
+                except EOFError:
+                    process = running[conn][3]
+                    process.join()
+                    message = f"Worker exited with code {process.exitcode}"
+                    if memory_cap:
+                        message += f" under the {memory_cap // (1024 * 1024)} MB memory cap"
+                    outcome = ("crash", message)
+                if outcome[0] == "started":
+                    baselines[conn] = outcome[1]
+                    continue
+                finish(conn, outcome)
+            if memory_cap:
+                for conn, (path, job_reader, retried, process, started) in list(running.items()):
+                    baseline = baselines.get(conn)
+                    rss = current_rss_bytes(process.pid) if baseline is not None else None
+                    if rss is not None and rss - baseline > memory_cap:
+                        process.kill()
+                        finish(conn, ("memory", memory_cap_message(memory_cap)))
+            if timeout:
+                now = time.monotonic()
+                for conn, (path, job_reader, retried, process, started) in list(running.items()):
+                    if now - started >= timeout:
+                        process.kill()
+                        finish(conn, ("timeout", f"Timed out after {timeout:g} s"))
+
+        while order and order[0] in outcomes:
+            path = order.popleft()
+            outcome = outcomes.pop(path)
+            if outcome[0] == "ok":
+                results, stats = outcome[1]
+                yield path, results, None, stats
+            else:
+                kind, message, job_reader, retried = outcome
+                stats = {'failure': kind, 'reader': job_reader, 'retried': retried}
+                yield path, None, WorkbookFailure(kind, message), stats
+
+# Function to extract a list of workbooks, yielding (file_path, results, error, stats) in the given order.
+# With a memory_limit (bytes) the run is bounded, and with prefetch the next workbooks are read
+# into memory while earlier ones are parsed: see extract_files_windowed. With several workers,
+# workbooks of split_bytes or more are also split by sheet: see submit_workbook.
+# With isolation (see make_isolation) every workbook runs in a process of its own instead, and
+# prefetch, splitting and the memory limit do not apply.
+def extract_files(file_paths, plans, workers=1, reader="openpyxl", memory_limit=None, prefetch=0,
+                  prefetch_bytes=DEFAULT_PREFETCH_BYTES, split_bytes=SPLIT_WORKBOOK_BYTES, isolation=None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if isolation:
+        yield from extract_files_isolated(file_paths, plans, workers, reader, isolation)
+        return
+
+    if workers <= 1 or len(file_paths) <= 1:
+        for file_path, data, read_error in iter_sources(file_paths, prefetch, prefetch_bytes):
+            if read_error is not None:
+                yield file_path, None, read_error, {}
+                continue
+            try:
+                results, stats = extract_workbook_with_stats(file_path, plans, reader, data)
+                yield file_path, results, None, stats
+            except Exception as e:
+                yield file_path, None, e, {}
+            del data
+            if memory_limit:
+                # Drop the workbook's reference cycles before the next file is parsed
+                gc.collect()
+        return
+
+    if memory_limit or prefetch:
+        sources = iter_sources(file_paths, prefetch, prefetch_bytes)
+        yield from extract_files_windowed(sources, plans, workers, reader, memory_limit, split_bytes)
+        return
+
+    # Largest files go first so the slowest workbook is never started last
+    schedule = sorted(file_paths, key=lambda path: os.path.getsize(path), reverse=True)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for path in schedule:
+            try:
+                futures[path] = submit_workbook(executor, path, plans, reader, None, workers, split_bytes)
+            except Exception as e:
+                futures[path] = e
+        # Results are handed back in the caller's order, not completion order
+        for file_path in file_paths:
+            try:
+                if isinstance(futures[file_path], Exception):
+                    raise futures[file_path]
+                results, stats = gather_workbook(file_path, plans, futures[file_path])
+                yield file_path, results, None, stats
+            except Exception as e:
+                yield file_path, None, e, {}
+
+# Fraction of the memory budget at which no further workbooks are started
+MEMORY_HEADROOM = 0.8
+
+# Function to extract workbooks from iter_sources in a sliding window over a process pool.
+# Workbooks are started in order, at most `workers` jobs at a time (a split workbook counts
+# once per part). With a memory_limit no new one is
+# started while the parent and the known workers together use more than MEMORY_HEADROOM of it,
+# so parallelism drops as the budget is approached. Each result is handed on as soon as it is
+# next in order, so finished rows never pile up.
+def extract_files_windowed(sources, plans, workers, reader, memory_limit=None, split_bytes=SPLIT_WORKBOOK_BYTES):
+    worker_pids = set()
+
+    def memory_in_use():
+        sizes = [current_rss_bytes()] + [current_rss_bytes(pid) for pid in worker_pids]
+        return sum(size for size in sizes if size)
+
+    sources = iter(sources)
+    exhausted = False
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        jobs = 0
+        while not exhausted or pending:
+            while not exhausted and jobs < workers:
+                if pending and memory_limit and memory_in_use() > memory_limit * MEMORY_HEADROOM:
+                    break
+                source = next(sources, None)
+                if source is None:
+                    exhausted = True
+                    break
+                path, data, read_error = source
+                if read_error is not None:
+                    pending.append((path, read_error))
+                    continue
+                try:
+                    futures = submit_workbook(executor, path, plans, reader, data, workers, split_bytes)
+                except Exception as e:
+                    pending.append((path, e))
+                    continue
+                pending.append((path, futures))
+                jobs += len(futures)
+                del data, source
+            if not pending:
+                break
+
+            file_path, futures = pending.popleft()
+            if isinstance(futures, Exception):
+                yield file_path, None, futures, {}
+                continue
+            jobs -= len(futures)
+            try:
+                results, stats = gather_workbook(file_path, plans, futures)
+            except Exception as e:
+                yield file_path, None, e, {}
+                continue
+            worker_pids.update(stats.get('worker_pids', [stats['pid']]))
+            yield file_path, results, None, stats
+
+# Function to extract a folder's workbooks through the cache, re-parsing only files that changed.
+# A checkpoint journal works the same way: files it holds are not parsed again, and every freshly
+# extracted file is committed to it before it is handed on.
+# Yields (file_path, results, error, stats) in the given order, like extract_files.
+# Cached rows are loaded one file at a time, as they are yielded.
+def iter_extractions(file_paths, plans, workers=1, cache=None, reader="openpyxl", memory_limit=None,
+                     prefetch=0, split_bytes=SPLIT_WORKBOOK_BYTES, journal=None, isolation=None):
+    stores = [store for store in (journal, cache) if store is not None]
+    if not stores:
+        yield from extract_files(file_paths, plans, workers, reader, memory_limit, prefetch,
+                                 split_bytes=split_bytes, isolation=isolation)
+        return
+
+    fresh = {}
+    stats = {}
+    hashes = {}
+    for file_path in file_paths:
+        stats[file_path] = os.stat(file_path)
+        for store in stores:
+            if store.is_fresh(file_path, plans):
+                fresh[file_path] = store
+                break
+        else:
+            # Hashed before extraction, so a workbook rewritten while it is read is stored under
+            # the old digest and extracted again next time, never cached with stale rows
+            hashes[file_path] = file_sha256(file_path)
+    if journal is not None:
+        print(f"Checkpoint: {journal.hits} of {len(file_paths)} files already done")
+    if cache is not None:
+        print(f"Cache: {cache.hits} of {len(file_paths)} files unchanged")
+
+    stale = [path for path in file_paths if path not in fresh]
+    extracted = extract_files(stale, plans, workers, reader, memory_limit, prefetch, split_bytes=split_bytes,
+                              isolation=isolation)
+    for file_path in file_paths:
+        if file_path in fresh:
+            yield file_path, fresh[file_path].load(file_path, plans), None, {'cached': True}
+            continue
+        file_path, results, error, file_stats = next(extracted)
+        if error is None:
+            for store in stores:
+                store.store(file_path, plans, results, stats[file_path], hashes[file_path])
+        yield file_path, results, error, file_stats
+    if cache is not None:
+        cache.prune(file_paths)
+
+# Class to stream a task's merged rows into a write-only sheet, so no Cell objects stay resident
+class MergeSheetWriter:
+    def __init__(self, merge_wb, task, plan):
+        self.ws = merge_wb.create_sheet(f"Merged Data {task['name']}")
+        self.transforms = task['transforms']
+        # Extracted values plus the sheet name in column S (19th column, index 19)
+        self.width = max(plan['proc_max_col'] - plan['proc_min_col'] + 1, 19)
+        self.rows_merged = 0
+        # Running totals, read by the metrics layer
+        self.transform_seconds = 0.0
+        self.write_seconds = 0.0
+
+    def write_header(self, width):
+        # Header row at the top with t1, t2, t3, ..., tn
+        self.ws.append([f"t{col}" for col in range(1, width + 1)])
+
+    def append(self, values, sheet_name):
+        if self.rows_merged == 0:
+            self.write_header(self.width)
+        self.rows_merged += 1
+
+        start = time.perf_counter()
+        row = list(values) + [None] * (self.width - len(values))
+        row[18] = sheet_name
+        for transform in self.transforms:
+            row = transform(row, self.ws)
+        written = time.perf_counter()
+        self.write_row(row)
+        self.transform_seconds += written - start
+        self.write_seconds += time.perf_counter() - written
+
+    def write_row(self, row):
+        self.ws.append(row)
+
+    def close(self):
+        # An empty merge still gets its header cell
+        if self.rows_merged == 0:
+            self.write_header(1)
+        # Transforms that mark the whole sheet at once, such as ConditionalZeroMarks, finish here
+        for transform in self.transforms:
+            finish = getattr(transform, 'finish', None)
+            if finish is not None:
+                finish(self.ws)
+        return self.rows_merged
+
+# Function to open the writer of a task's merged sheet; combining tasks get an olecombine.CombiningSheetWriter
+def open_merge_writer(merge_wb, task, plan):
+    if task.get('combine') is None:
+        return MergeSheetWriter(merge_wb, task, plan)
+    from olecombine import CombiningSheetWriter
+    return CombiningSheetWriter(merge_wb, task, plan)
+
+# Function to get the file name a task is merged into; combined=False names its uncombined merge
+def merge_filename(task, combined=None):
+    if combined is None:
+        combined = task.get('combine') is not None
+    if combined:
+        return f"merge_{task['name']}_processed.xlsx"
+    return f"merge_{task['name']}.xlsx"
+
+# Function to get every file name in target_folder a merge of these tasks may have written, whether
+# it combined them or not, and the combined workbook when it is saved there
+def merge_filenames(target_folder, tasks, combined_path=None):
+    filenames = {merge_filename(task, combined) for task in tasks for combined in (False, True)}
+    if combined_path and os.path.dirname(os.path.abspath(combined_path)) == os.path.abspath(target_folder):
+        filenames.add(os.path.basename(combined_path))
+    return filenames
+
+# Function to open the write-only workbook(s) for a merge run, returning {task name: (workbook, path)}
+def open_merge_outputs(target_folder, tasks, combined_path=None):
+    outputs = {}
+    combined_wb = Workbook(write_only=True) if combined_path else None
+    for task in tasks:
+        if combined_path:
+            outputs[task['name']] = (combined_wb, combined_path)
+        else:
+            path = os.path.join(target_folder, merge_filename(task))
+            outputs[task['name']] = (Workbook(write_only=True), path)
+    return outputs
+
+# Function to merge every task in one pass over the folder, streaming rows to the output as they arrive.
+# Each task is saved to merge_<name>.xlsx (see merge_filename), or all tasks go to one workbook when
+# combined_path is given. A combining task whose rows cannot be combined is saved uncombined as
+# merge_<name>.xlsx and passed to metrics.record_combine_failure.
+# With use_cache, unchanged workbooks are served from the cache file in the target folder.
+# reader selects how sheets are parsed ("openpyxl" or the faster "xml"); both give the same rows.
+# metrics, an olemetrics.RunMetrics, receives per-file and per-sheet measurements.
+# memory_limit (bytes) bounds the run's memory and prefetch reads that many workbooks ahead of the
+# parser: see extract_files_windowed. Workbooks of split_bytes or more are split by sheet across
+# the workers (see submit_workbook).
+# With checkpoint, each extracted workbook is journaled as it completes; a later run with resume
+# skips the workbooks already journaled and writes the same output as an uninterrupted run.
+# With skip_duplicates, byte-identical copies of a workbook are merged only once; skipped
+# workbooks and template copies (see make_task) are printed and passed to metrics.record_skip.
+# isolation (see make_isolation) runs each workbook in its own process with a timeout and memory cap.
+def merge_folder(target_folder, tasks, workers=1, combined_path=None, use_cache=False, reader="openpyxl",
+                 metrics=None, memory_limit=None, prefetch=0, split_bytes=SPLIT_WORKBOOK_BYTES,
+                 checkpoint=False, resume=False, skip_duplicates=False, isolation=None):
+    plans = build_plans(tasks)
+    outputs = open_merge_outputs(target_folder, tasks, combined_path)
+    writers = {
+        task['name']: open_merge_writer(outputs[task['name']][0], task, plan)
+        for task, plan in zip(tasks, plans)
+    }
+
+    files_processed = 0
+    sheets_processed = {task['name']: 0 for task in tasks}
+
+    cache = ExtractionCache(target_folder) if use_cache else None
+    journal = CheckpointJournal(target_folder, resume) if checkpoint or resume else None
+    files_failed = 0
+
+    # Merge outputs of this and earlier runs, with or without combining, live in the same folder but are not sources
+    file_paths = list_source_files(target_folder, merge_filenames(target_folder, tasks, combined_path))
+
+    if skip_duplicates:
+        file_paths, duplicates = drop_duplicate_files(file_paths)
+        for file_path, original in duplicates:
+            print(f"Skipping file: {os.path.basename(file_path)}, identical to {os.path.basename(original)}")
+            if metrics is not None:
+                metrics.record_skip(file_path, None, os.path.basename(original))
+
+    # Files are parsed in parallel when workers > 1, but merged in the same order as a serial run
+    extractions = iter_extractions(file_paths, plans, workers, cache, reader, memory_limit, prefetch, split_bytes,
+                                   journal, isolation)
+    for file_path, results, error, stats in extractions:
+        filename = os.path.basename(file_path)
+        print(f"Processing file: {filename}")
+
+        if metrics is not None:
+            metrics.record_file(file_path, stats, error)
+
+        if error is not None:
+            print(f"Error processing file {filename}: {str(error)}")
+            files_failed += 1
+            continue
+
+        for sheet_name, template in stats.get('template_copies', {}).items():
+            print(f"  Skipping sheet: {sheet_name}, unchanged copy of {template}")
+            if metrics is not None:
+                metrics.record_skip(file_path, sheet_name, template)
+
+        for task in tasks:
+            writer = writers[task['name']]
+            for sheet_name, rows in results[task['name']]:
+                print(f"  {task['name']} sheet: {sheet_name}, copying {len(rows)} rows")
+                transform_before, write_before = writer.transform_seconds, writer.write_seconds
+                for values in rows:
+                    writer.append(values, sheet_name)
+                sheets_processed[task['name']] += 1
+                if metrics is not None:
+                    metrics.record_sheet(
+                        file_path, sheet_name, task['name'], len(rows), stats.get('sheets', {}).get(sheet_name, {}),
+                        writer.transform_seconds - transform_before, writer.write_seconds - write_before
+                    )
+
+        files_processed += 1
+
+    if cache is not None:
+        cache.close()
+
+    for task in tasks:
+        writer = writers[task['name']]
+        rows_merged = writer.close()
+        print(f"Process completed for {task['name']}. Files processed: {files_processed}, Sheets processed: {sheets_processed[task['name']]}")
+        print(f"Total non-blank rows merged: {rows_merged}")
+        # Rows that could not be combined are saved as the plain merge, never under the _processed name
+        combine_error = getattr(writer, 'combine_error', None)
+        if combine_error is not None:
+            if not combined_path:
+                merge_wb, _ = outputs[task['name']]
+                outputs[task['name']] = (merge_wb, os.path.join(target_folder, merge_filename(task, combined=False)))
+            if metrics is not None:
+                metrics.record_combine_failure(task['name'], combine_error)
+
+    # A combined workbook is shared by every task but saved once
+    merge_paths = {}
+    all_saved = True
+    for task in tasks:
+        merge_wb, merge_path = outputs[task['name']]
+        if merge_path not in merge_paths.values():
+            start = time.perf_counter()
+            saved = save_merge(merge_wb, merge_path)
+            all_saved = all_saved and saved
+            if metrics is not None:
+                metrics.record_save(merge_path, time.perf_counter() - start, saved)
+        merge_paths[task['name']] = merge_path
+
+    if journal is not None:
+        # The journal is kept for --resume until a run completes without failed files or saves
+        journal.close(completed=all_saved and not files_failed)
+
+    if metrics is not None:
+        metrics.finish()
+    return merge_paths
+
+# Function to get the temporary file an output is written to before it is renamed into place
+def temporary_path(path):
+    folder, filename = os.path.split(os.path.abspath(path))
+    return os.path.join(folder, f".~{filename}.tmp")
+
+# Function to save a merged workbook, reporting rather than raising on failure; returns whether it saved.
+# The workbook is written to a temporary file next to it and renamed over the old one, so readers
+# never see a half-written merge.
+def save_merge(merge_wb, merge_path):
+    temp_path = temporary_path(merge_path)
+    try:
+        merge_wb.save(temp_path)
+        os.replace(temp_path, merge_path)
+        print(f"Merged data saved to {merge_path}")
+    except Exception as e:
+        print(f"Error saving merged file: {str(e)}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    return True
@@ -0,0 +1,244 @@
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+# Peak RSS of this process before its last reset_peak_rss, which on Linux also resets ru_maxrss
+peak_before_reset = 0
+
+# Function to get this process's peak resident set size in bytes, or None if it cannot be read.
+# With children, the peak of the largest of its finished (waited for) child processes instead,
+# which is only known where the resource module is.
+def peak_rss_bytes(children=False):
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        peak = peak if sys.platform == "darwin" else peak * 1024
+        return peak if children else max(peak, peak_before_reset)
+    if children:
+        return None
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, "peak_wset", info.rss)
+
+# Function to start a new peak RSS measurement, read with peak_rss_since_reset, by resetting this
+# process's high-water mark (Linux only); the peak so far is kept for peak_rss_bytes. Returns whether it could.
+def reset_peak_rss():
+    global peak_before_reset
+    peak = peak_rss_bytes()
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    peak_before_reset = max(peak_before_reset, peak or 0)
+    return True
+
+# Function to get this process's peak RSS since the last reset_peak_rss in bytes, or None
+def peak_rss_since_reset():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+# Function to get the current resident set size of a process (default: this one) in bytes, or None
+def current_rss_bytes(pid=None):
+    pid = pid or os.getpid()
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except Exception:
+        return None
+
+# Class to collect per-file and per-sheet measurements of a merge run.
+# Every record is also passed to callback(kind, record), kind being "file", "sheet", "skip", "save",
+# "combine" or "run".
+class RunMetrics:
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.started = time.perf_counter()
+        self.run = {'started': datetime.now().isoformat(timespec="seconds")}
+        self.files = []
+        self.sheets = []
+        self.skips = []
+        self.saves = []
+        self.combine_failures = []
+
+    def emit(self, kind, record):
+        if self.callback is not None:
+            self.callback(kind, record)
+
+    def record_file(self, file_path, stats, error=None):
+        record = {
+            'file': os.path.basename(file_path),
+            'cached': bool(stats.get('cached')),
+            'bytes_read': stats.get('bytes_read', 0),
+            'open': stats.get('open'),
+            'extract': stats.get('extract'),
+            'peak_rss': stats.get('peak_rss'),
+            'rss_growth': stats.get('rss_growth'),
+            'error': str(error) if error is not None else None,
+            'failure': stats.get('failure', "error" if error is not None else None),
+            'retried': bool(stats.get('retried')),
+        }
+        self.files.append(record)
+        self.emit("file", record)
+
+    def record_sheet(self, file_path, sheet_name, task_name, rows, sheet_stats, transform, write):
+        record = {
+            'file': os.path.basename(file_path),
+            'sheet': sheet_name,
+            'task': task_name,
+            'rows': rows,
+            'parse': sheet_stats.get('parse'),
+            'select': sheet_stats.get('select'),
+            'transform': transform,
+            'write': write,
+        }
+        self.sheets.append(record)
+        self.emit("sheet", record)
+
+    # A workbook (sheet_name None) or sheet left out as a duplicate of another
+    def record_skip(self, file_path, sheet_name, duplicate_of):
+        record = {'file': os.path.basename(file_path), 'sheet': sheet_name, 'duplicate_of': duplicate_of}
+        self.skips.append(record)
+        self.emit("skip", record)
+
+    def record_save(self, merge_path, seconds, saved=True):
+        record = {'path': merge_path, 'save': seconds, 'saved': saved}
+        self.saves.append(record)
+        self.emit("save", record)
+
+    # A combining task (see olemerge.make_task) whose rows were saved uncombined
+    def record_combine_failure(self, task_name, error):
+        record = {'task': task_name, 'error': error}
+        self.combine_failures.append(record)
+        self.emit("combine", record)
+
+    def finish(self):
+        self.run.update({
+            'elapsed': time.perf_counter() - self.started,
+            'files': len(self.files),
+            'failed_files': sum(1 for record in self.files if record['error']),
+            'cached_files': sum(1 for record in self.files if record['cached']),
+            'skipped_files': sum(1 for record in self.skips if record['sheet'] is None),
+            'skipped_sheets': sum(1 for record in self.skips if record['sheet'] is not None),
+            'failed_saves': sum(1 for record in self.saves if not record['saved']),
+            'failed_combines': len(self.combine_failures),
+            'bytes_read': sum(record['bytes_read'] for record in self.files),
+            'rows': sum(record['rows'] for record in self.sheets),
+            'peak_rss': peak_rss_bytes(),
+        })
+        self.emit("run", self.run)
+
+    # Files ordered by the time they took, slowest first
+    def slowest_files(self, count=10):
+        def total(record):
+            return (record['open'] or 0) + (record['extract'] or 0)
+        return sorted(self.files, key=total, reverse=True)[:count]
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump({'run': self.run, 'files': self.files, 'sheets': self.sheets, 'skips': self.skips,
+                       'saves': self.saves, 'combine_failures': self.combine_failures}, f, indent=2)
+
+    # One CSV row per workbook that failed: how it failed, the error and whether it was retried
+    def write_failures(self, path):
+        fields = ['file', 'failure', 'error', 'retried']
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            for record in self.files:
+                if record['error']:
+                    writer.writerow(record)
+
+    # One CSV row per (file, sheet, task), with the file's open/extract figures repeated
+    def write_csv(self, path):
+        files = {record['file']: record for record in self.files}
+        fields = ['file', 'sheet', 'task', 'rows', 'parse', 'select', 'transform', 'write',
+                  'open', 'extract', 'bytes_read', 'peak_rss', 'rss_growth']
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for record in self.sheets:
+                file_record = files.get(record['file'], {})
+                writer.writerow(dict(record, **{key: file_record.get(key) for key in fields[8:]}))
+
+# Class to sample the stacks of one thread and count them in collapsed form ("a;b;c count"),
+# the input format of flamegraph.pl and speedscope
+class StackSampler:
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.counts = Counter()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def write_collapsed(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+# Function to run func under a profiler and dump the result next to output_prefix.
+# mode "cprofile" writes <prefix>.prof (pstats) and <prefix>.txt; mode "sample" writes
+# <prefix>.collapsed. Only the calling process is profiled, not pool workers.
+def profile_run(mode, output_prefix, func, *args, **kwargs):
+    if mode == "cprofile":
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, *args, **kwargs)
+        finally:
+            profiler.dump_stats(f"{output_prefix}.prof")
+            with open(f"{output_prefix}.txt", "w") as f:
+                pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(40)
+
+    if mode == "sample":
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sampler.stop()
+            sampler.write_collapsed(f"{output_prefix}.collapsed")
+
+    raise ValueError(f"Unknown profile mode: {mode}")
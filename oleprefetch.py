@@ -0,0 +1,90 @@
+import io
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Read-ahead for slow folders (OneDrive/SharePoint sync, network shares): a few threads read the
+# next workbooks fully into memory while the current one is parsed, so the parser rarely waits on
+# the disk. Only read I/O runs in the threads, which releases the GIL.
+
+DEFAULT_PREFETCH_BYTES = 256 * 1024 * 1024
+
+# Function to read a whole file into memory
+def read_file(file_path):
+    with open(file_path, "rb") as f:
+        return f.read()
+
+# Class to open a workbook as a read-only memory map, usable wherever a file object is. Processes
+# mapping the same file share one copy of its bytes in the page cache instead of each reading it.
+class MappedFile(io.RawIOBase):
+    def __init__(self, file_path):
+        self.file = open(file_path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self.map[self.position:self.position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.map)
+        self.position = max(offset, 0)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        if not self.closed:
+            self.map.close()
+            self.file.close()
+        super().close()
+
+# Class to read files ahead of their consumer. Iterating yields (file_path, data, error) in the
+# given order; at most `depth` files are read ahead, and no new read starts while the files in
+# flight add up to more than max_bytes (one file is always read, however large it is).
+class Prefetcher:
+    def __init__(self, file_paths, depth=4, max_bytes=DEFAULT_PREFETCH_BYTES, threads=2):
+        self.file_paths = list(file_paths)
+        self.depth = max(depth, 1)
+        self.max_bytes = max_bytes
+        self.threads = threads
+
+    def __iter__(self):
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            pending = deque()
+            bytes_in_flight = 0
+            next_idx = 0
+            while next_idx < len(self.file_paths) or pending:
+                while next_idx < len(self.file_paths) and len(pending) < self.depth:
+                    path = self.file_paths[next_idx]
+                    try:
+                        size = os.path.getsize(path)
+                    except OSError:
+                        size = 0
+                    if pending and bytes_in_flight + size > self.max_bytes:
+                        break
+                    pending.append((path, size, executor.submit(read_file, path)))
+                    bytes_in_flight += size
+                    next_idx += 1
+
+                file_path, size, future = pending.popleft()
+                bytes_in_flight -= size
+                try:
+                    data = future.result()
+                except OSError as e:
+                    yield file_path, None, e
+                    continue
+                yield file_path, data, None
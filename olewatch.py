@@ -0,0 +1,133 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+# Watch-folder mode: the folder is watched with inotify where the platform has it, or polled
+# otherwise. A burst of changes (sync clients write in several steps) is waited out, then the
+# merge runs again; with the extraction cache only the changed workbooks are parsed.
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+# Function to tell whether a file name is a source workbook worth reacting to
+def is_source_name(filename, ignored=()):
+    return filename.lower().endswith(".xlsx") and not filename.startswith("~$") and filename not in ignored
+
+# Class to wait for changes with Linux inotify; wait() returns the names changed, or an empty set
+class InotifyWatcher:
+    kind = "inotify"
+
+    def __init__(self, folder):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"Cannot watch {folder}")
+
+    def wait(self, timeout):
+        changed = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            _, _, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b"\0")
+            offset += name_length
+            if name:
+                changed.add(os.fsdecode(name))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+# Class to wait for changes by comparing the folder's file sizes and mtimes between polls
+class PollingWatcher:
+    kind = "polling"
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self):
+        snapshot = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        snapshot = self.take_snapshot()
+        changed = {
+            name for name in snapshot.keys() | self.snapshot.keys()
+            if snapshot.get(name) != self.snapshot.get(name)
+        }
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+# Function to open the best watcher for a folder: inotify on Linux, polling elsewhere or if it fails
+def open_watcher(folder, polling=False):
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folder)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}), polling instead")
+    return PollingWatcher(folder)
+
+# Function to run `run` once, then again after every burst of changes to the folder's workbooks,
+# until interrupted or until the `stop` event is set. A burst ends once no workbook has changed for
+# `debounce` seconds; `interval` is how often the folder is checked. `ignored` names files the run
+# writes itself, such as the merge outputs.
+def watch_folder(target_folder, run, debounce=2.0, interval=1.0, ignored=(), polling=False, stop=None):
+    watcher = open_watcher(target_folder, polling)
+    print(f"Watching {target_folder} for changes ({watcher.kind}), press Ctrl+C to stop")
+
+    def changed_sources(timeout):
+        return {name for name in watcher.wait(timeout) if is_source_name(name, ignored)}
+
+    try:
+        run()
+        while stop is None or not stop.is_set():
+            changed = changed_sources(interval)
+            if not changed:
+                continue
+            while True:
+                more = changed_sources(debounce)
+                if not more:
+                    break
+                changed |= more
+            print(f"Changed: {', '.join(sorted(changed))}")
+            run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
@@ -0,0 +1,295 @@
+import posixpath
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+from openpyxl.utils.datetime import from_excel, from_ISO8601, WINDOWS_EPOCH, CALENDAR_MAC_1904
+
+# Fast range reader for fixed-layout workbooks. It streams the sheet XML straight out of the
+# zip, keeps only the cells inside the requested block and converts values the same way
+# openpyxl does with data_only=True, so either reader can be picked per run.
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+ROW_TAG = f"{{{MAIN_NS}}}row"
+CELL_TAG = f"{{{MAIN_NS}}}c"
+VALUE_TAG = f"{{{MAIN_NS}}}v"
+INLINE_TAG = f"{{{MAIN_NS}}}is"
+TEXT_TAG = f"{{{MAIN_NS}}}t"
+RUN_TAG = f"{{{MAIN_NS}}}r"
+SI_TAG = f"{{{MAIN_NS}}}si"
+SHEET_DATA_TAG = f"{{{MAIN_NS}}}sheetData"
+
+# Column letters -> index, filled as references are seen
+_column_cache = {}
+
+# Function to split a cell reference such as "CV26" into (row, column)
+def split_reference(ref):
+    split = 0
+    while ref[split].isalpha():
+        split += 1
+    letters = ref[:split]
+    column = _column_cache.get(letters)
+    if column is None:
+        column = 0
+        for ch in letters:
+            column = column * 26 + ord(ch) - 64
+        _column_cache[letters] = column
+    return int(ref[split:]), column
+
+# Function to get the text of a string item (<si> or <is>) without its formatting
+def string_item_text(element):
+    snippets = []
+    plain = element.find(TEXT_TAG)
+    if plain is not None and plain.text is not None:
+        snippets.append(plain.text)
+    for run in element.findall(RUN_TAG):
+        text = run.findtext(TEXT_TAG)
+        if text is not None:
+            snippets.append(text)
+    return "".join(snippets)
+
+# Function to resolve a relationship target to a zip member name
+def resolve_target(base_dir, target):
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join(base_dir, target))
+
+# Function to read the workbook parts: sheet list, shared strings part, epoch and date styles
+def read_workbook_info(archive):
+    rels = ET.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    targets = {}
+    shared_strings = None
+    styles = None
+    for rel in rels.iter(f"{{{PKG_REL_NS}}}Relationship"):
+        target = resolve_target("xl", rel.get("Target"))
+        rel_type = rel.get("Type", "")
+        targets[rel.get("Id")] = (target, rel_type)
+        if rel_type.endswith("/sharedStrings"):
+            shared_strings = target
+        elif rel_type.endswith("/styles"):
+            styles = target
+
+    workbook = ET.fromstring(archive.read("xl/workbook.xml"))
+    sheets = []
+    for sheet in workbook.iter(f"{{{MAIN_NS}}}sheet"):
+        target, rel_type = targets[sheet.get(f"{{{REL_NS}}}id")]
+        sheets.append((sheet.get("name"), target, rel_type.endswith("/worksheet")))
+
+    epoch = WINDOWS_EPOCH
+    workbook_pr = workbook.find(f"{{{MAIN_NS}}}workbookPr")
+    if workbook_pr is not None and workbook_pr.get("date1904") in ("1", "true"):
+        epoch = CALENDAR_MAC_1904
+
+    date_styles, timedelta_styles = read_date_styles(archive, styles)
+    return sheets, shared_strings, epoch, date_styles, timedelta_styles
+
+# Function to find which cell style ids format numbers as dates or durations
+def read_date_styles(archive, styles_part):
+    date_styles = set()
+    timedelta_styles = set()
+    if styles_part is None or styles_part not in archive.namelist():
+        return date_styles, timedelta_styles
+
+    styles = ET.fromstring(archive.read(styles_part))
+    custom = {
+        int(fmt.get("numFmtId")): fmt.get("formatCode")
+        for fmt in styles.iter(f"{{{MAIN_NS}}}numFmt")
+    }
+    cell_xfs = styles.find(f"{{{MAIN_NS}}}cellXfs")
+    if cell_xfs is None:
+        return date_styles, timedelta_styles
+
+    for idx, xf in enumerate(cell_xfs.findall(f"{{{MAIN_NS}}}xf")):
+        num_fmt_id = int(xf.get("numFmtId", 0))
+        fmt = custom[num_fmt_id] if num_fmt_id in custom else builtin_format_code(num_fmt_id)
+        if is_date_format(fmt):
+            date_styles.add(idx)
+        if is_timedelta_format(fmt):
+            timedelta_styles.add(idx)
+    return date_styles, timedelta_styles
+
+# Function to convert a numeric cell the way openpyxl does, including date-styled serials
+def cast_number(text, style_id, epoch, date_styles, timedelta_styles):
+    if "." in text or "E" in text or "e" in text:
+        value = float(text)
+    else:
+        value = int(text)
+    if style_id in date_styles:
+        try:
+            value = from_excel(value, epoch, timedelta=style_id in timedelta_styles)
+        except (OverflowError, ValueError):
+            value = "#VALUE!"
+    return value
+
+# Function to read one sheet's block as lists; shared string cells are queued in `pending`.
+# Probe cells (row, column) are read first and passed to admit(); when it returns nothing the
+# sheet is abandoned right there and None is returned, otherwise (block, admit's result).
+def read_sheet_block(archive, part, min_row, max_row, min_col, max_col, info, pending,
+                     strings, probe_cells=(), admit=None):
+    epoch, date_styles, timedelta_styles = info
+    width = max_col - min_col + 1
+    block = [[None] * width for _ in range(max_row - min_row + 1)]
+
+    probe_values = {}
+    probe_rows = {row for row, _ in probe_cells}
+    last_probe_row = max(probe_rows) if probe_rows else 0
+    admitted = None if probe_cells else admit({})
+
+    row_number = 0
+    in_rows = False
+    in_probe_row = False
+    col_counter = 0
+    with archive.open(part) as source:
+        for event, element in ET.iterparse(source, events=("start", "end")):
+            tag = element.tag
+            if event == "start":
+                if tag == ROW_TAG:
+                    ref = element.get("r")
+                    row_number = int(ref) if ref else row_number + 1
+                    if admitted is None and row_number > last_probe_row:
+                        admitted = admit(resolve_probes(probe_values, strings))
+                        if not admitted:
+                            return None
+                    # Rows are stored in order, so nothing past the last requested row is needed
+                    if row_number > max_row and row_number > last_probe_row:
+                        break
+                    in_rows = min_row <= row_number <= max_row
+                    in_probe_row = row_number in probe_rows
+                    col_counter = 0
+                continue
+
+            if tag == CELL_TAG:
+                if in_rows or in_probe_row:
+                    ref = element.get("r")
+                    if ref:
+                        col_counter = split_reference(ref)[1]
+                    else:
+                        col_counter += 1
+                    if in_probe_row and (row_number, col_counter) in probe_cells:
+                        probe_values[(row_number, col_counter)] = read_cell_value(
+                            element, epoch, date_styles, timedelta_styles)
+                    if in_rows and min_col <= col_counter <= max_col:
+                        value = read_cell_value(element, epoch, date_styles, timedelta_styles)
+                        row = block[row_number - min_row]
+                        if type(value) is SharedString:
+                            pending.append((row, col_counter - min_col, value.index))
+                        else:
+                            row[col_counter - min_col] = value
+                else:
+                    col_counter += 1
+            elif tag == ROW_TAG:
+                element.clear()
+            elif tag == SHEET_DATA_TAG:
+                break
+
+    # The sheet ended before any row past the probes
+    if admitted is None:
+        admitted = admit(resolve_probes(probe_values, strings))
+        if not admitted:
+            return None
+    return block, admitted
+
+# Function to turn shared string placeholders among probe values into text
+def resolve_probes(probe_values, strings):
+    return {
+        cell: strings[value.index] if type(value) is SharedString else value
+        for cell, value in probe_values.items()
+    }
+
+# Placeholder for a shared string that has not been resolved yet
+class SharedString:
+    __slots__ = ("index",)
+
+    def __init__(self, index):
+        self.index = index
+
+# Function to read a cell's cached value (data_only semantics)
+def read_cell_value(element, epoch, date_styles, timedelta_styles):
+    data_type = element.get("t", "n")
+    if data_type == "inlineStr":
+        child = element.find(INLINE_TAG)
+        return string_item_text(child) if child is not None else None
+
+    text = element.findtext(VALUE_TAG) or None
+    if text is None:
+        return None
+    if data_type == "n":
+        style_id = int(element.get("s", 0))
+        return cast_number(text, style_id, epoch, date_styles, timedelta_styles)
+    if data_type == "s":
+        return SharedString(int(text))
+    if data_type == "b":
+        return bool(int(text))
+    if data_type == "d":
+        return from_ISO8601(text)
+    # "str" formula results and "e" errors are kept as text
+    return text
+
+# Class to read the shared string table lazily: strings are parsed in order only as far as
+# the highest index asked for, so a workbook whose kept cells use early strings stops early
+class SharedStrings:
+    def __init__(self, archive, part):
+        self.archive = archive
+        self.part = part
+        self.strings = []
+        self.source = None
+        self.items = None
+
+    def __getitem__(self, index):
+        if self.items is None:
+            self.source = self.archive.open(self.part)
+            self.items = ET.iterparse(self.source, events=("end",))
+        while len(self.strings) <= index:
+            event, element = next(self.items)
+            if element.tag == SI_TAG:
+                self.strings.append(string_item_text(element).replace('x005F_', ''))
+                element.clear()
+        return self.strings[index]
+
+    def close(self):
+        if self.source is not None:
+            self.source.close()
+
+# Function to read the same block from every worksheet the gate admits.
+# The gate provides plans_for(name), probe_cells(name) and admitted_plans(name, values).
+# Returns [(sheet_name, block, plans)] with every block padded to the full requested size.
+# A stats dict, when given, receives the open time and each sheet's parse time.
+def read_sheet_blocks(file_path, min_row, max_row, min_col, max_col, gate, stats=None):
+    if stats is None:
+        stats = {}
+    stats.setdefault('sheets', {})
+    start = time.perf_counter()
+    with zipfile.ZipFile(file_path) as archive:
+        sheets, shared_strings, epoch, date_styles, timedelta_styles = read_workbook_info(archive)
+        info = (epoch, date_styles, timedelta_styles)
+        strings = SharedStrings(archive, shared_strings)
+        stats['open'] = time.perf_counter() - start
+
+        try:
+            pending = []
+            blocks = []
+            for sheet_name, part, is_worksheet in sheets:
+                if not gate.plans_for(sheet_name):
+                    continue
+                if not is_worksheet:
+                    raise ValueError(f"Sheet {sheet_name} is not a worksheet")
+                start = time.perf_counter()
+                result = read_sheet_block(
+                    archive, part, min_row, max_row, min_col, max_col, info, pending, strings,
+                    set(gate.probe_cells(sheet_name)),
+                    lambda values, name=sheet_name: gate.admitted_plans(name, values)
+                )
+                if result is not None:
+                    blocks.append((sheet_name, result[0], result[1]))
+                stats['sheets'][sheet_name] = {'parse': time.perf_counter() - start}
+
+            start = time.perf_counter()
+            for row, col, string_index in pending:
+                row[col] = strings[string_index]
+            stats['shared_strings'] = time.perf_counter() - start
+        finally:
+            strings.close()
+    return [(sheet_name, [tuple(row) for row in block], plans) for sheet_name, block, plans in blocks]